@@ -0,0 +1,44 @@
+"""
+Tests for the recode plugin's table of recodes
+"""
+
+import numpy
+import pytest
+
+pytest.importorskip('osgeo')
+pytest.importorskip('PySide6')
+pytest.importorskip('tuiview')
+
+from PySide6.QtCore import Qt  # noqa: E402
+
+from tuiview_plugins.recode.recode import RecodeTableModel  # noqa: E402
+
+
+def makeModel(dtype):
+    info = numpy.iinfo(dtype)
+    dataValues = numpy.arange(info.min, info.max + 1, dtype=dtype)
+    return RecodeTableModel(None, dataValues)
+
+
+@pytest.mark.parametrize('dtype, badValue',
+    [(numpy.uint8, 256), (numpy.uint8, 300), (numpy.uint8, -1),
+    (numpy.int16, 32768), (numpy.int16, -32769)])
+def test_outOfRangeRefused(dtype, badValue):
+    model = makeModel(dtype)
+    index = model.index(10, 1)
+    assert not model.setData(index, str(badValue), Qt.EditRole)
+    assert model.getRecodedValues() == {}
+
+
+def test_inRangeAccepted():
+    model = makeModel(numpy.uint8)
+    index = model.index(10, 1)
+    assert model.setData(index, '255', Qt.EditRole)
+    assert model.getRecodedValues() == {10: 255}
+
+
+def test_notAnIntRefused():
+    model = makeModel(numpy.uint8)
+    index = model.index(10, 1)
+    assert not model.setData(index, 'abc', Qt.EditRole)
+    assert model.getRecodedValues() == {}
@@ -0,0 +1,79 @@
+"""
+Tests for recoding the data in newfile_from_recode.py
+"""
+
+import os
+import sys
+
+import numpy
+import pytest
+
+# not a package, the script imports it from its own directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir,
+    'tuiview_plugins', 'recode', 'bin'))
+import recodedata  # noqa: E402
+
+
+@pytest.fixture(params=[True, False], ids=['numba', 'numpy'])
+def useNumba(request, monkeypatch):
+    if request.param and not recodedata.HAVE_NUMBA:
+        pytest.skip('numba not available')
+    monkeypatch.setattr(recodedata, 'HAVE_NUMBA', request.param)
+    return request.param
+
+
+def referenceRecode(data, mask, oldValues, newValues):
+    """
+    One value at a time, each compared against the original data
+    """
+    result = data.copy()
+    for old, new in zip(oldValues, newValues):
+        result[mask & (data == old)] = new
+    return result
+
+
+def makeData(dtype, values, shape=(41, 29)):
+    """
+    Random data made up of values, plus the smallest and largest
+    values for dtype, with a random mask
+    """
+    rng = numpy.random.default_rng(7)
+    info = numpy.iinfo(dtype)
+    choices = numpy.array(list(values) + [info.min, info.max], dtype=dtype)
+    data = rng.choice(choices, size=shape)
+    mask = rng.random(shape) < 0.7
+    return data, mask
+
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.int8, numpy.uint16,
+    numpy.int16, numpy.uint32, numpy.int32, numpy.int64])
+def test_recodeData(useNumba, dtype):
+    dtype = numpy.dtype(dtype)
+    info = numpy.iinfo(dtype)
+    # sorted as doRecodes() does. Includes swapped values which
+    # mustn't chain
+    recodes = sorted({int(info.min): 3, 3: 5, 5: 3, 100: int(info.max),
+        int(info.max): 0}.items())
+    oldValues = numpy.array([old for old, new in recodes], dtype=numpy.int64)
+    newValues = numpy.array([new for old, new in recodes])
+
+    data, mask = makeData(dtype, [0, 1, 3, 4, 5, 6, 99, 100, 101])
+    expected = referenceRecode(data, mask, oldValues, newValues)
+
+    lut = recodedata.createRecodeLUT(dtype, oldValues, newValues)
+    if dtype.itemsize > 2:
+        assert lut is None
+    else:
+        assert lut.size == 2 ** (dtype.itemsize * 8)
+
+    recodedata.recodeData(data, mask, oldValues, newValues, lut)
+    numpy.testing.assert_array_equal(data, expected)
+
+
+def test_noRecodes(useNumba):
+    data, mask = makeData(numpy.uint8, [1, 2, 3])
+    expected = data.copy()
+    oldValues = numpy.array([], dtype=numpy.int64)
+    newValues = numpy.array([], dtype=numpy.int64)
+    recodedata.recodeData(data, mask, oldValues, newValues)
+    numpy.testing.assert_array_equal(data, expected)
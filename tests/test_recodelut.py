@@ -0,0 +1,104 @@
+"""
+Tests for applying recodes with lookup tables in the recode plugin
+"""
+
+import numpy
+import pytest
+
+from tuiview_plugins.recode import recodelut
+
+
+@pytest.fixture(params=[True, False], ids=['numba', 'numpy'])
+def useNumba(request, monkeypatch):
+    if request.param and not recodelut.HAVE_NUMBA:
+        pytest.skip('numba not available')
+    monkeypatch.setattr(recodelut, 'HAVE_NUMBA', request.param)
+    return request.param
+
+
+def referenceRecode(data, mask, recodes):
+    """
+    One value at a time, each compared against the original data
+    """
+    result = data.copy()
+    for old, new in recodes.items():
+        result[mask & (data == old)] = numpy.array(new).astype(data.dtype)
+    return result
+
+
+def makeData(dtype, values, shape=(37, 53)):
+    """
+    Random data made up of values, plus the smallest and largest
+    values for dtype, with a random mask
+    """
+    rng = numpy.random.default_rng(42)
+    info = numpy.iinfo(dtype)
+    choices = numpy.array(list(values) + [info.min, info.max], dtype=dtype)
+    data = rng.choice(choices, size=shape)
+    mask = rng.random(shape) < 0.7
+    return data, mask
+
+
+def checkRecodes(dtype, recodes, otherValues, expectedBase):
+    data, mask = makeData(dtype, list(recodes) + otherValues)
+    expected = referenceRecode(data, mask, recodes)
+
+    lutInfo = recodelut.createRecodeLUT(recodes, dtype)
+    if expectedBase == 'none':
+        assert lutInfo is None
+    else:
+        assert lutInfo[1] == expectedBase
+
+    recodelut.applyRecodes(data, mask, recodes, lutInfo)
+    numpy.testing.assert_array_equal(data, expected)
+
+
+@pytest.mark.parametrize('dtype', [numpy.uint8, numpy.int8, numpy.uint16,
+    numpy.int16])
+def test_fullTable(useNumba, dtype):
+    info = numpy.iinfo(dtype)
+    # includes swapping values, which mustn't chain
+    recodes = {info.min: 3, 3: info.max, 5: 7, 7: 5, -1 % info.max: 0}
+    checkRecodes(dtype, recodes, [0, 1, 2, 4, 6, 8], None)
+
+
+@pytest.mark.parametrize('dtype', [numpy.uint32, numpy.int32, numpy.uint64,
+    numpy.int64])
+def test_rangedTable(useNumba, dtype):
+    recodes = {100: 200, 200: 100, 150: 0, 1000: 5}
+    checkRecodes(dtype, recodes, [0, 99, 101, 999, 1001, 123456], 100)
+
+
+def test_rangedNegative(useNumba):
+    recodes = {-500: 7, -3: -500, 20: 21}
+    checkRecodes(numpy.int32, recodes, [-501, -4, 0, 19, 22], -500)
+
+
+def test_rangedUint64Large(useNumba):
+    # values that numpy would make float64 if left to pick the type
+    big = 2 ** 63 + 5
+    recodes = {big: 5828129723138410141, big + 1: 2 ** 64 - 1, big + 7: 1}
+    checkRecodes(numpy.uint64, recodes, [0, big - 1, big + 2, big + 8], big)
+
+
+@pytest.mark.parametrize('dtype', [numpy.int32, numpy.uint64])
+def test_noTable(useNumba, dtype):
+    recodes = {10: 20, 20: 10, 10 + recodelut.MAX_LUT_SIZE: 3}
+    checkRecodes(dtype, recodes, [0, 11, 30], 'none')
+
+
+def test_noRecodes(useNumba):
+    assert recodelut.createRecodeLUT({}, numpy.uint32) is None
+    checkRecodes(numpy.uint8, {}, [1, 2, 3], None)
+
+
+def test_scratch(useNumba):
+    recodes = {100: 200, 200: 100}
+    data, mask = makeData(numpy.int32, [50, 100, 200, 300])
+    expected = referenceRecode(data, mask, recodes)
+    lutInfo = recodelut.createRecodeLUT(recodes, data.dtype)
+    scratch = numpy.empty_like(data)
+    maskScratch = numpy.empty(data.shape, dtype=numpy.bool_)
+    recodelut.applyRecodes(data, mask, recodes, lutInfo, scratch,
+        maskScratch)
+    numpy.testing.assert_array_equal(data, expected)
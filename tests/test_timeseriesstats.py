@@ -0,0 +1,90 @@
+"""
+Tests for the timeseries plugin's polygon statistics
+"""
+
+import numpy
+import pytest
+
+from tuiview_plugins.timeseries import timeseriesstats
+from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_MIN
+from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_MAX
+from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_MEAN
+from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_MEDIAN
+from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_STDDEV
+
+DTYPES = [numpy.uint8, numpy.int16, numpy.uint32, numpy.int64,
+    numpy.float32, numpy.float64]
+
+
+@pytest.fixture(params=[True, False], ids=['numba', 'numpy'])
+def useNumba(request, monkeypatch):
+    if request.param and not timeseriesstats.HAVE_NUMBA:
+        pytest.skip('numba not available')
+    monkeypatch.setattr(timeseriesstats, 'HAVE_NUMBA', request.param)
+    return request.param
+
+
+def makeData(dtype, shape=(45, 31)):
+    """
+    Random data with a mask that leaves some rows empty
+    """
+    rng = numpy.random.default_rng(3)
+    data = (rng.random(shape) * 200).astype(dtype)
+    mask = rng.random(shape) < 0.4
+    mask[::4] = False
+    return data, mask
+
+
+def reference(data, mask):
+    """
+    The statistics of a copy of the values inside the mask
+    """
+    values = data[mask].astype(numpy.float64)
+    return {SUMMARY_MIN: values.min(), SUMMARY_MAX: values.max(),
+        SUMMARY_MEAN: values.mean(), SUMMARY_MEDIAN: numpy.median(values),
+        SUMMARY_STDDEV: values.std()}
+
+
+@pytest.mark.skipif(not timeseriesstats.HAVE_NUMBA,
+    reason='numba not available')
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_maskedStats(dtype):
+    data, mask = makeData(dtype)
+    expected = reference(data, mask)
+    minVal, maxVal, mean, stddev = timeseriesstats.maskedStats(data, mask)
+    assert minVal == expected[SUMMARY_MIN]
+    assert maxVal == expected[SUMMARY_MAX]
+    assert mean == pytest.approx(expected[SUMMARY_MEAN], rel=1e-6)
+    assert stddev == pytest.approx(expected[SUMMARY_STDDEV], rel=1e-6)
+
+
+@pytest.mark.skipif(not timeseriesstats.HAVE_NUMBA,
+    reason='numba not available')
+def test_maskedStatsSingleValue():
+    data = numpy.full((5, 5), 17, dtype=numpy.int32)
+    mask = numpy.zeros(data.shape, dtype=numpy.bool_)
+    mask[3, 2] = True
+    assert timeseriesstats.maskedStats(data, mask) == (17, 17, 17.0, 0.0)
+
+
+@pytest.mark.parametrize('method', [SUMMARY_MIN, SUMMARY_MAX, SUMMARY_MEAN,
+    SUMMARY_MEDIAN, SUMMARY_STDDEV])
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_summarizeMasked(useNumba, dtype, method):
+    data, mask = makeData(dtype)
+    original = data.copy()
+    expected = reference(data, mask)
+    stats = timeseriesstats.summarizeMasked(data, mask, method)
+    for key, value in stats.items():
+        assert value == pytest.approx(expected[key], rel=1e-6)
+    assert method in stats
+    # the data is shared with the viewer so mustn't change
+    numpy.testing.assert_array_equal(data, original)
+
+
+def test_unknownMethod(monkeypatch):
+    # with numba every method but the median is worked out at once
+    monkeypatch.setattr(timeseriesstats, 'HAVE_NUMBA', False)
+    data, mask = makeData(numpy.uint8)
+    with pytest.raises(ValueError):
+        timeseriesstats.summarizeMasked(data, mask, 99)
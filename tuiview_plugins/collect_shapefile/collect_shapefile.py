@@ -22,6 +22,8 @@ https://github.com/ubarsc/tuiview/wiki/Plugins
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
+import struct
+import numpy
 from tuiview import pluginmanager
 from tuiview.viewerwidget import VIEWER_TOOL_POLYGON, VIEWER_TOOL_NONE
 from tuiview.viewerwidget import VIEWER_TOOL_QUERY, VIEWER_TOOL_POLYLINE
@@ -36,6 +38,9 @@ COLLECT_NONE = 0
 COLLECT_POLY = 1
 COLLECT_LINE = 2
 COLLECT_POINT = 3
+SYNC_EVERY = 10  # number of features collected between writes to disk
+
+driverCache = None  # set by getDriver()
 
 
 def name():
@@ -50,6 +55,34 @@ def description():
     return 'Tool for creating shapefiles by clicking on points on the viewer'
 
 
+def getDriver():
+    """
+    Return the OGR driver for DRIVERNAME, looking it up the first time
+    """
+    global driverCache
+    if driverCache is None:
+        driverCache = ogr.GetDriverByName(DRIVERNAME)
+        if driverCache is None:
+            raise IOError("%s driver not available" % DRIVERNAME)
+    return driverCache
+
+
+def polygonToWKB(poly, geomType):
+    """
+    Create the WKB for a QPolygonF as either a ogr.wkbLineString
+    or a single ring ogr.wkbPolygon so the whole geometry can be
+    given to OGR in one call rather than a point at a time.
+    """
+    xy = numpy.array([(pt.x(), pt.y()) for pt in poly],
+                dtype='<f8').reshape(-1, 2)
+    # little endian header, then the number of rings for a polygon
+    if geomType == ogr.wkbPolygon:
+        header = struct.pack('<BIII', 1, geomType, 1, len(xy))
+    else:
+        header = struct.pack('<BII', 1, geomType, len(xy))
+    return header + xy.tobytes()
+
+
 class CollectShapefile(QObject):
     """
     Class that contains the plugin
@@ -58,6 +91,10 @@ class CollectShapefile(QObject):
         QObject.__init__(self)
         self.ogrds = None
         self.ogrlyr = None
+        self.lyrDefn = None
+        self.feat = None  # reused for each feature collected
+        self.srsCache = {}  # osr.SpatialReference keyed on wkt
+        self.unsyncedCount = 0  # features collected since the last sync
         self.collecting = COLLECT_NONE
         self.isCollecting = False
         self.viewer = viewer
@@ -115,9 +152,7 @@ class CollectShapefile(QObject):
         fname, _ = QFileDialog.getSaveFileName(None, "Select Shape File name",
                 "", "Shape Files (*.shp)")
         if fname is not None and fname != '':
-            driver = ogr.GetDriverByName(DRIVERNAME)
-            if driver is None:
-                raise IOError("%s driver not available" % DRIVERNAME)
+            driver = getDriver()
     
             self.ogrds = driver.CreateDataSource(fname)
             if self.ogrds is None:
@@ -129,8 +164,11 @@ class CollectShapefile(QObject):
                 raise ValueError("No raster Layers loaded")
                 
             wkt = layer.gdalDataset.GetProjection()
-            srs = osr.SpatialReference()
-            srs.ImportFromWkt(wkt)
+            srs = self.srsCache.get(wkt)
+            if srs is None:
+                srs = osr.SpatialReference()
+                srs.ImportFromWkt(wkt)
+                self.srsCache[wkt] = srs
                 
             lyrName = os.path.basename(fname)
             lyrName, _ = os.path.splitext(lyrName)
@@ -138,6 +176,9 @@ class CollectShapefile(QObject):
             if self.ogrlyr is None:
                 self.ogrds = None
                 raise IOError("Unable to create layer")
+            self.lyrDefn = self.ogrlyr.GetLayerDefn()
+            self.feat = ogr.Feature(self.lyrDefn)
+            self.unsyncedCount = 0
     
             self.newPolyAction.setEnabled(False)
             self.newLineAction.setEnabled(False)
@@ -152,6 +193,8 @@ class CollectShapefile(QObject):
         self.ogrds.SyncToDisk()
         self.ogrds = None
         self.ogrlyr = None
+        self.lyrDefn = None
+        self.feat = None
         self.newPolyAction.setEnabled(True)
         self.newLineAction.setEnabled(True)
         self.newPointAction.setEnabled(True)
@@ -178,45 +221,42 @@ class CollectShapefile(QObject):
         if self.isCollecting:
             self.viewer.viewwidget.setActiveTool(VIEWER_TOOL_NONE, id(self))
 
-            feat = ogr.Feature(self.ogrlyr.GetLayerDefn())
+            # CreateFeature() copies the feature so we can reuse
+            # the same one. Clear the FID set by the last CreateFeature()
+            feat = self.feat
+            feat.SetFID(-1)
             
             if self.collecting == COLLECT_POLY:
                 # PolygonToolInfo
                 poly = info.getWorldPolygon()
             
-                ogrpoly = ogr.Geometry(ogr.wkbPolygon)
-                ogrring = ogr.Geometry(ogr.wkbLinearRing)
-                for n in range(poly.size()):
-                    pt = poly[n]
-                    ogrring.AddPoint_2D(pt.x(), pt.y())
-                
-                ogrpoly.AddGeometry(ogrring)
-                
-                feat.SetGeometry(ogrpoly)
+                wkb = polygonToWKB(poly, ogr.wkbPolygon)
+                ogrpoly = ogr.CreateGeometryFromWkb(wkb)
+                feat.SetGeometryDirectly(ogrpoly)
                 
             elif self.collecting == COLLECT_LINE:
                 # PolylineToolInfo
                 poly = info.getWorldPolygon()
             
-                feat = ogr.Feature(self.ogrlyr.GetLayerDefn())
-                ogrline = ogr.Geometry(ogr.wkbLineString)
-                for n in range(poly.size()):
-                    pt = poly[n]
-                    ogrline.AddPoint_2D(pt.x(), pt.y())
-                
-                feat.SetGeometry(ogrline)
+                wkb = polygonToWKB(poly, ogr.wkbLineString)
+                ogrline = ogr.CreateGeometryFromWkb(wkb)
+                feat.SetGeometryDirectly(ogrline)
                 
             else:
                 # QueryInfo
-                feat = ogr.Feature(self.ogrlyr.GetLayerDefn())
                 ogrpoint = ogr.Geometry(ogr.wkbPoint)
                 ogrpoint.AddPoint_2D(info.easting, info.northing)
-                feat.SetGeometry(ogrpoint)
+                feat.SetGeometryDirectly(ogrpoint)
 
             if self.ogrlyr.CreateFeature(feat) != 0:
                 print("Failed to create feature in shapefile")
                 
-            self.ogrlyr.SyncToDisk()
+            # don't write out every feature as it is collected,
+            # closeFile() makes sure everything ends up on disk
+            self.unsyncedCount += 1
+            if self.unsyncedCount >= SYNC_EVERY:
+                self.ogrlyr.SyncToDisk()
+                self.unsyncedCount = 0
                 
             self.isCollecting = False
 
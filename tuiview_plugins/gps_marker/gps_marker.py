@@ -24,14 +24,13 @@ https://github.com/ubarsc/tuiview/wiki/Plugins
 # Needs gpsd + Python bindings installed
 # Python3 version of bindings here: https://github.com/tpoche/gps-python3
 
-import math
 try:
     import gps
 except ImportError:
     print('gps module not found - plugin will not work as expected')
 from tuiview import pluginmanager
 from tuiview.viewerlayers import CURSOR_CROSSHAIR
-from PySide6.QtCore import QObject, QTimer, Qt
+from PySide6.QtCore import QObject, QSocketNotifier, QThread, Qt, Signal
 from PySide6.QtWidgets import QApplication, QMessageBox
 from PySide6.QtGui import QAction
 from osgeo import osr
@@ -39,6 +38,11 @@ from osgeo import osr
 # set in action() below
 GEOLINKED_VIEWERS = None
 
+# coordinate transforms from the GPS to a projection, keyed on the wkt
+# of the projection. Shared by all the GPSMarker instances as they
+# are slow to create.
+COORD_TRANS_CACHE = {}
+
 
 def name():
     return 'GPS Marker'
@@ -52,16 +56,64 @@ def description():
     return 'Shows GPS location on the viewer. Requires gpsd.'
 
 
+def getCoordinateTransform(wkt):
+    """
+    Return a coordinate transform from the GPS coordinate system to
+    the given projection. Returns None if it can't be created.
+    """
+    coordTrans = COORD_TRANS_CACHE.get(wkt)
+    if coordTrans is None:
+        gpsSR = osr.SpatialReference()
+        # GPS uses 4328 but I can't get to work with 
+        # GDAL so using 4326 instead. Hopefully not a big difference...
+        gpsSR.ImportFromEPSG(4326)
+        tuiviewSR = osr.SpatialReference()
+        tuiviewSR.ImportFromWkt(wkt)
+        coordTrans = osr.CreateCoordinateTransformation(gpsSR, tuiviewSR)
+        if coordTrans is not None:
+            COORD_TRANS_CACHE[wkt] = coordTrans
+    return coordTrans
+
+
+class GPSConnectThread(QThread):
+    """
+    Connects to gpsd in a separate thread so the GUI doesn't stop
+    while it happens. This can take a while if gpsd isn't there.
+    """
+    # signals
+    connected = Signal(object, name='connected')
+    failed = Signal(name='failed')
+
+    def run(self):
+        try:
+            gpsd = gps.GPS(mode=gps.WATCH_ENABLE)
+        except OSError:
+            self.failed.emit()
+        else:
+            self.connected.emit(gpsd)
+
+
 class GPSMarker(QObject):
     """
     Class that is the plugin
     """
+    # all the GPSMarker objects (one per open viewer) so they can
+    # tell each other about changes without going through
+    # all the plugin handlers. Removed in viewerDestroyed().
+    instances = []
+
     def __init__(self, viewer):
         QObject.__init__(self)
         self.viewer = viewer
         self.gpsd = None
-        self.timer = None
+        self.notifier = None
+        self.connectThread = None
         self.coordTrans = None
+        # so we don't keep trying to create the transform
+        # on every GPS update when there is nothing to create it from
+        self.coordTransAttempted = False
+        # (easting, northing) last shown on the viewers
+        self.lastLocation = None
 
         self.startAct = QAction(self, triggered=self.startLogging)
         self.startAct.setText("Start Logging")
@@ -77,14 +129,32 @@ class GPSMarker(QObject):
         gpsMenu.addAction(self.startAct)
         gpsMenu.addAction(self.endAct)
 
+        viewer.viewwidget.layers.layersChanged.connect(self.layersChanged)
+
+        GPSMarker.instances.append(self)
+        viewer.destroyed.connect(self.viewerDestroyed)
+
+    def viewerDestroyed(self):
+        """
+        Our viewer has been closed. Stop the other GPS Marker plugins
+        talking to us and stop logging if we were the one doing it.
+        """
+        if self in GPSMarker.instances:
+            GPSMarker.instances.remove(self)
+
+        logging = self.notifier is not None and self.notifier.isEnabled()
+        self.disconnectGPS()
+        if logging:
+            # let the others start logging again
+            self.endLogging()
+
     def getOtherGPSMarkerState(self):
         """
         Sees if other GPS Marker plugins are logging or not
         """
         state = True
-        app = QApplication.instance()
-        for plugin in app.pluginHandlers:
-            if isinstance(plugin, GPSMarker) and plugin is not self:
+        for plugin in GPSMarker.instances:
+            if plugin is not self:
                 state = plugin.loggingEnabled
                 break
         return state
@@ -94,9 +164,8 @@ class GPSMarker(QObject):
         Tells all the other GPS Marker plugins of the new state
         so they can update GUI
         """
-        app = QApplication.instance()
-        for plugin in app.pluginHandlers:
-            if isinstance(plugin, GPSMarker) and plugin is not self:
+        for plugin in GPSMarker.instances:
+            if plugin is not self:
                 if not state:
                     plugin.setEnableLogging(state)
                 else:
@@ -112,20 +181,79 @@ class GPSMarker(QObject):
         self.endAct.setEnabled(not state)
         self.loggingEnabled = state
 
+    def connectGPS(self):
+        """
+        Start connecting to gpsd in the background. gpsConnected()
+        or gpsConnectFailed() get called when this has finished.
+        """
+        # stop the user trying again while this happens
+        self.startAct.setEnabled(False)
+        self.connectThread = GPSConnectThread(self)
+        self.connectThread.connected.connect(self.gpsConnected)
+        self.connectThread.failed.connect(self.gpsConnectFailed)
+        self.connectThread.finished.connect(self.connectThread.deleteLater)
+        self.connectThread.start()
+
+    def gpsConnected(self, gpsd):
+        """
+        Connection to gpsd made. Create the notifier that tells us
+        when it has sent something. Both are reused between start
+        and end of logging until the connection is lost.
+        """
+        self.connectThread = None
+        if self not in GPSMarker.instances:
+            # viewer closed while we were connecting
+            gpsd.close()
+            return
+        self.gpsd = gpsd
+        self.notifier = QSocketNotifier(self.gpsd.sock.fileno(),
+                        QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.updateGPS)
+        self.loggingStarted()
+
+    def gpsConnectFailed(self):
+        """
+        Couldn't connect to gpsd
+        """
+        self.connectThread = None
+        self.startAct.setEnabled(True)
+        QMessageBox.critical(self.viewer, name(), "Unable to connect to GPS")
+
+    def disconnectGPS(self):
+        """
+        Drop the connection to gpsd so the next startLogging()
+        makes a new one.
+        """
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+        if self.gpsd is not None:
+            self.gpsd.close()
+            self.gpsd = None
+
     def startLogging(self):
+        if self.gpsd is None:
+            # carries on in gpsConnected()
+            self.connectGPS()
+            return
+
         try:
-            if self.gpsd is None:
-                self.gpsd = gps.GPS(mode=gps.WATCH_ENABLE)
-            else:
-                self.gpsd.stream(gps.WATCH_ENABLE)
+            self.gpsd.stream(gps.WATCH_ENABLE)
         except OSError: 
+            # don't hang on to a connection that has gone bad
+            self.disconnectGPS()
             QMessageBox.critical(self.viewer, name(), "Unable to connect to GPS")
             return
 
-        if self.timer is None:
-            self.timer = QTimer()
-            self.timer.timeout.connect(self.updateGPS)
-        self.timer.start(1000)
+        self.loggingStarted()
+
+    def loggingStarted(self):
+        """
+        We are connected to gpsd and it is sending us data.
+        Start listening and update the GUIs.
+        """
+        self.notifier.setEnabled(True)
         self.setEnableLogging(False)
         self.setOtherGPSMarkerState(False)
     
@@ -133,62 +261,97 @@ class GPSMarker(QObject):
         if self.gpsd is not None:
             self.gpsd.stream(gps.WATCH_DISABLE)
 
-        if self.timer is not None:
-            self.timer.stop()
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
 
         GEOLINKED_VIEWERS.removeQueryPointAll(id(self))
+        self.lastLocation = None
         self.setEnableLogging(True)
         if updateOthers:
             self.setOtherGPSMarkerState(True)
 
+    def layersChanged(self):
+        """
+        The layers in our viewer have changed. Any of the GPS Marker
+        plugins may now be able to create a coordinate transform
+        so get them to try again. Also make sure the location gets
+        shown on the new layers.
+        """
+        for plugin in GPSMarker.instances:
+            plugin.coordTransAttempted = False
+            plugin.lastLocation = None
+
     def setCoordinateTransform(self):
         """
         Sets up a coordinate transform between the GPS data and the
         coordinate system in use by the viewers. Saved in self.coordTrans
         """
+        self.coordTransAttempted = True
         if GEOLINKED_VIEWERS is not None:
             for viewer in GEOLINKED_VIEWERS.viewers:
                 layer = viewer.viewwidget.layers.getTopRasterLayer()
                 if layer is not None:
                     wkt = layer.gdalDataset.GetProjection()
                     if wkt is not None and wkt != '':
-                        gpsSR = osr.SpatialReference()
-                        # GPS uses 4328 but I can't get to work with 
-                        # GDAL so using 4326 instead. Hopefully not a big difference...
-                        gpsSR.ImportFromEPSG(4326)
-                        tuiviewSR = osr.SpatialReference()
-                        tuiviewSR.ImportFromWkt(wkt)
-                        self.coordTrans = osr.CreateCoordinateTransformation(gpsSR, tuiviewSR)
+                        self.coordTrans = getCoordinateTransform(wkt)
                         if self.coordTrans is None:
                             print('Unable to create coordinate transform. ' + 
                                 'Check GDAL built with proj.4 support')
                         break
                         
+    def locationMoved(self, easting, northing):
+        """
+        Returns True if (easting, northing) is on a different display
+        pixel to the location last shown in any of the viewers.
+        """
+        if self.lastLocation is None:
+            return True
+
+        lastEasting, lastNorthing = self.lastLocation
+        for viewer in GEOLINKED_VIEWERS.viewers:
+            layer = viewer.viewwidget.layers.getTopRasterLayer()
+            if layer is not None:
+                coordmgr = layer.coordmgr
+                if (coordmgr.world2display(easting, northing) !=
+                        coordmgr.world2display(lastEasting, lastNorthing)):
+                    return True
+        return False
+
     def updateGPS(self):
         if self.gpsd is not None:
             try:
                 self.gpsd.next()
+                # only the latest fix is of interest so read
+                # anything else that has arrived in the meantime
+                while self.gpsd.waiting(0):
+                    self.gpsd.next()
 
-                if self.coordTrans is None:
+                if self.coordTrans is None and not self.coordTransAttempted:
                     self.setCoordinateTransform()
                 # still could have failed
                 if self.coordTrans is not None:
 
                     long = self.gpsd.fix.longitude
                     lat = self.gpsd.fix.latitude
-                    if (lat != 0 and not math.isnan(lat) and 
-                            long != 0 and not math.isnan(long)):
+                    # no fix yet is 0 or NaN (which is never equal to itself)
+                    if lat != 0 and long != 0 and lat == lat and long == long:
                         (easting, northing, _) = self.coordTrans.TransformPoint(long, lat)
                         if easting == 0 or northing == 0:
                             print('coord transform failed')
-                        else:
+                        elif self.locationMoved(easting, northing):
+                            # otherwise don't make all the viewers
+                            # redraw when nothing would change
                             GEOLINKED_VIEWERS.setQueryPointAll(id(self), 
                                 easting, northing, Qt.white, 
                                 cursor=CURSOR_CROSSHAIR, size=5)
+                            self.lastLocation = (easting, northing)
 
             except StopIteration:
-                # no data
-                print('no data')
+                # gpsd has closed the connection. Stop listening
+                # otherwise we will be told about it continuously
+                print('lost connection to gpsd')
+                self.disconnectGPS()
+                self.endLogging()
 
 
 def action(actioncode, viewer):
@@ -25,7 +25,7 @@ import os
 import sys
 import time
 from tuiview import pluginmanager
-from PySide6.QtCore import QObject
+from PySide6.QtCore import QObject, QTimer
 from PySide6.QtWidgets import QApplication
 
 TMPDIR = os.getenv('TMP', '/tmp')
@@ -34,6 +34,11 @@ if sys.platform == 'win32':
 else:
     UID = str(os.getuid())
 SHAREDFILE = os.path.join(TMPDIR, 'locationbcast_%s' % UID)
+# written first then renamed over SHAREDFILE. Includes the process
+# id so TuiViews running at the same time don't write over each other's
+SHAREDFILE_TMP = '%s.%d.tmp' % (SHAREDFILE, os.getpid())
+# minimum time between writes of SHAREDFILE (ms)
+WRITE_INTERVAL = 100
 
 
 class NewLocationHandler(QObject):
@@ -43,23 +48,49 @@ class NewLocationHandler(QObject):
     def __init__(self, viewer):
         QObject.__init__(self)
         self.viewer = viewer
+        # geolinkMove can be emitted many times a second when
+        # panning, so only write the latest location when this fires
+        self.writeTimer = QTimer(self)
+        self.writeTimer.setSingleShot(True)
+        self.writeTimer.setInterval(WRITE_INTERVAL)
+        self.writeTimer.timeout.connect(self.writeLocation)
+        # the time string only changes once a second
+        self.lastTimeSec = None
+        self.lastIsoTime = None
 
     def onNewLocation(self, obj):
         "new location to broadcast"
-        # obj is a GeolinkInfo, but
-        # it doesn't contain the extent (just the centre)
+        if not self.writeTimer.isActive():
+            self.writeTimer.start()
+
+    def writeLocation(self):
+        "write the current location to SHAREDFILE"
+        # the GeolinkInfo given to onNewLocation
+        # doesn't contain the extent (just the centre)
         # easiest just to query the widget again
         layer = self.viewer.viewwidget.layers.getTopRasterLayer()
         if layer is not None:
             extent = layer.coordmgr.getWorldExtent()
 
-            iso_time = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
-
-            # truncate the existing file and re-write values
-            fileobj = open(SHAREDFILE, 'w+')
-            fileobj.write('%s %f %f %f %f\n' % (iso_time, extent[0], extent[1], 
-                        extent[2], extent[3]))
-            fileobj.close()
+            now = int(time.time())
+            if now != self.lastTimeSec:
+                self.lastIsoTime = time.strftime("%Y-%m-%dT%H:%M:%S", 
+                                time.localtime(now))
+                self.lastTimeSec = now
+            iso_time = self.lastIsoTime
+
+            # write a new file and rename it over the existing one
+            # so readers never see a partially written file
+            try:
+                with open(SHAREDFILE_TMP, 'w') as fileobj:
+                    fileobj.write('%s %f %f %f %f\n' % (iso_time, extent[0],
+                            extent[1], extent[2], extent[3]))
+                os.replace(SHAREDFILE_TMP, SHAREDFILE)
+            except OSError:
+                # e.g. Windows won't replace the file while a reader
+                # has it open. Try again shortly rather than leaving
+                # the old location there if the view stops moving.
+                self.writeTimer.start()
 
 
 def name():
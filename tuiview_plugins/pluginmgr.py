@@ -21,12 +21,14 @@ A Gui manager for plugins
 
 import os
 import sys
+import json
 import argparse
 from PySide6.QtWidgets import QApplication, QMainWindow, QWidget
 from PySide6.QtWidgets import QTableView, QHBoxLayout, QVBoxLayout, QPushButton
 from PySide6.QtWidgets import QTextEdit
 from PySide6.QtCore import Qt, QAbstractTableModel, QSettings, Signal
 
+import tuiview
 from tuiview import pluginmanager
 
 # import tuiview_plugins. This will either be relative
@@ -42,6 +44,12 @@ MESSAGE_TITLE = "TuiView Plugin Manager"
 # for settings
 SELECTED_PLUGINS = "SelectedPlugins"
 
+# getPluginInfo() saves its result here so the plugins don't need
+# to be imported again until they change
+CACHE_DIR = os.path.join(os.getenv('XDG_CACHE_HOME',
+        os.path.join(os.path.expanduser('~'), '.cache')), 'tuiview-plugins')
+CACHE_FILE = os.path.join(CACHE_DIR, 'plugininfo.json')
+
 # So we work with older TuiView that doesn't have this
 if hasattr(pluginmanager, 'PLUGIN_DESC_FN'):
     PLUGIN_DESC_FN = getattr(pluginmanager, 'PLUGIN_DESC_FN')
@@ -49,9 +57,91 @@ else:
     PLUGIN_DESC_FN = 'description'
 
 
+def getPluginSignature():
+    """
+    Return a dictionary describing the Python and TuiView in use and
+    with a list of [name, modification time, size] for each of the
+    Python files in the directories under PLUGINS_LOC. If this changes
+    the plugins need to be loaded again.
+    """
+    files = []
+    for entry in os.scandir(PLUGINS_LOC):
+        if entry.is_dir():
+            for fileEntry in os.scandir(entry.path):
+                if fileEntry.name.endswith('.py') and fileEntry.is_file():
+                    stat = fileEntry.stat()
+                    files.append([os.path.join(entry.name,
+                        fileEntry.name), stat.st_mtime_ns, stat.st_size])
+    files.sort()
+
+    # a different Python or TuiView may be able to load plugins
+    # that failed before (or not load ones that worked)
+    tuiviewVersion = getattr(tuiview, '__version__',
+                        getattr(tuiview, 'TUIVIEW_VERSION', None))
+    signature = {'python': [sys.executable, sys.version],
+        'tuiview': [os.path.dirname(tuiview.__file__), tuiviewVersion],
+        'files': files}
+    return signature
+
+
+def readPluginInfoCache(signature):
+    """
+    Return the list of plugin info saved by writePluginInfoCache(), or
+    None if there isn't one or it was saved for different plugins.
+    """
+    try:
+        with open(CACHE_FILE) as fileobj:
+            cache = json.load(fileobj)
+    except (OSError, ValueError):
+        return None
+
+    if (not isinstance(cache, dict) or cache.get('location') != PLUGINS_LOC or
+            cache.get('signature') != signature):
+        return None
+
+    return [tuple(info) for info in cache['plugins']]
+
+
+def writePluginInfoCache(signature, plugins):
+    """
+    Save the plugin info for readPluginInfoCache(). Failure isn't
+    a problem, the plugins just get loaded again next time.
+    """
+    cache = {'location': PLUGINS_LOC, 'signature': signature,
+        'plugins': plugins}
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(CACHE_FILE, 'w') as fileobj:
+            json.dump(cache, fileobj)
+    except OSError:
+        pass
+
+
 def getPluginInfo(quiet=False):
     """
-    Return a list of (name, author, description, path) tuples
+    Return a list of (name, author, description, path) tuples.
+    Uses the cache if the plugins haven't changed since last time.
+    """
+    signature = getPluginSignature()
+    plugins = readPluginInfoCache(signature)
+    if plugins is None:
+        plugins = loadPluginInfo(quiet)
+
+        # don't save it if any of the plugins failed to load (a
+        # dependency missing etc) so they get tried again next time
+        # rather than staying hidden
+        loadedDirs = {os.path.basename(info[-1]) for info in plugins}
+        pluginDirs = {os.path.dirname(fileInfo[0])
+                for fileInfo in signature['files']}
+        if pluginDirs.issubset(loadedDirs):
+            writePluginInfoCache(signature, plugins)
+    return plugins
+
+
+def loadPluginInfo(quiet=False):
+    """
+    Load all the plugins and return a list of
+    (name, author, description, path) tuples
     """
     if quiet:
         # ensure stdout redirected
@@ -59,26 +149,22 @@ def getPluginInfo(quiet=False):
         old_stdout = sys.stdout
         sys.stdout = f
 
-    plugins = []
     mgr = pluginmanager.PluginManager()
 
     # load all the plugins in each directory under PLUGINS_LOC 
+    # Note: done one at a time as loading imports each plugin and
+    # adds to mgr.plugins, neither of which are safe to do from threads
     for entry in os.scandir(PLUGINS_LOC):
         if entry.is_dir():
             mgr.loadPluginsFromDir(entry.path)
 
     # now go through all the plugins loaded
-    for name, plugin in mgr.plugins.items():
-        author = getattr(plugin, pluginmanager.PLUGIN_AUTHOR_FN)
-        authorTxt = author()
-        desc = getattr(plugin, PLUGIN_DESC_FN)
-        descTxt = desc()
-
-        subdir = os.path.dirname(plugin.__file__)
-        path = os.path.join(PLUGINS_LOC, subdir)
-        path = os.path.abspath(path)
-
-        plugins.append((name, authorTxt, descTxt, path))
+    authorFn = pluginmanager.PLUGIN_AUTHOR_FN
+    descFn = PLUGIN_DESC_FN
+    plugins = [(name, getattr(plugin, authorFn)(), getattr(plugin, descFn)(),
+            os.path.abspath(os.path.join(PLUGINS_LOC,
+                os.path.dirname(plugin.__file__))))
+            for name, plugin in mgr.plugins.items()]
 
     if quiet:
         # reset 
@@ -141,16 +227,19 @@ class PluginGuiApplication(QApplication):
         self.setOrganizationName('TuiView')
 
         settings = QSettings()
-        selected = settings.value(SELECTED_PLUGINS, "")
-        self.selected = selected.split(",")
+        selected = settings.value(SELECTED_PLUGINS, [])
+        if selected is None:
+            selected = []
+        elif isinstance(selected, str):
+            # older versions saved a comma separated string. Also
+            # some backends return a list of one item as a plain string
+            selected = [sel for sel in selected.split(",") if sel != '']
+        self.selected = list(selected)
 
-        valid = [info[0] for info in pluginInfo]
+        valid = {info[0] for info in pluginInfo}
 
         # strip out any that don't exist
-        validSelected = []
-        for sel in self.selected:
-            if sel in valid:
-                validSelected.append(sel)
+        validSelected = [sel for sel in self.selected if sel in valid]
 
         if gui:
             self.window = PluginGuiWindow(pluginInfo, validSelected)
@@ -220,8 +309,7 @@ class PluginGuiWidget(QWidget):
 
     def saveAndExit(self):
         settings = QSettings()
-        selected = ','.join(self.tableModel.selected)
-        settings.setValue(SELECTED_PLUGINS, selected)
+        settings.setValue(SELECTED_PLUGINS, list(self.tableModel.selected))
         self.parent.close()
 
 
@@ -235,15 +323,14 @@ class PluginTableModel(QAbstractTableModel):
     def __init__(self, parent, pluginInfo, selected):
         QAbstractTableModel.__init__(self, parent)
         self.pluginInfo = pluginInfo
-        self.selected = selected
+        self.pathsByName = {info[0]: info[-1] for info in pluginInfo}
+        # a dictionary (with values of None) rather than a list so
+        # we can check quickly whether a plugin is selected but
+        # still keep them in the order they were selected
+        self.selected = dict.fromkeys(selected)
 
     def getPaths(self):
-        paths = []
-        for sel in self.selected:
-            for inf in self.pluginInfo:
-                if inf[0] == sel:
-                    paths.append(inf[-1])
-        return paths
+        return [self.pathsByName[sel] for sel in self.selected]
 
     def flags(self, index):
         "Have to override to make it checkable"
@@ -299,10 +386,9 @@ class PluginTableModel(QAbstractTableModel):
             row = index.row()
             name = self.pluginInfo[row][0]
             if Qt.CheckState(value) == Qt.Checked:
-                if name not in self.selected:
-                    self.selected.append(name)
+                self.selected[name] = None
             else:
-                self.selected.remove(name)
+                self.selected.pop(name, None)
 
             self.selectedChangedSig.emit()
 
@@ -336,11 +422,9 @@ def printSourceLine(shell, selected, info):
     Print line to be sourced
     """
     # get the paths
-    selectedPaths = []
-    for sel in selected:
-        for inf in info:
-            if inf[0] == sel:
-                selectedPaths.append(inf[-1])
+    pathsByName = {inf[0]: inf[-1] for inf in info}
+    selectedPaths = [pathsByName[sel] for sel in selected
+            if sel in pathsByName]
 
     if shell.endswith('DOS'):
         print(getAsDOSString(selectedPaths))
@@ -31,6 +31,9 @@ from rios import ratapplier
 from osgeo import ogr
 from tuiview import vectorrasterizer
 
+# next to this script
+from recodedata import createRecodeLUT, recodeData
+
 # can't import the recode plugin which is a bit of a pain...
 RECODE_EXT = ".recode"
 "Extension after the image file extension that the recodes are saved to"
@@ -64,10 +67,22 @@ def riosRecode(info, inputs, outputs, otherArgs):
     ysize, xsize = data.shape
     extent = (info.blocktl.x, info.blocktl.y, info.blockbr.x, 
             info.blockbr.y)
+    left, top, right, bottom = extent
+
+    if otherArgs.luts is None:
+        # now we know the type of the data. Same for every block.
+        otherArgs.luts = [createRecodeLUT(data.dtype, oldValues, newValues)
+                for geom, comment, oldValues, newValues in otherArgs.recodes]
 
     # as we aren't dealing with an OGR dataset we can't use GDAL
     # so use the TuiView internals again.
-    for geom, comment, recodedValues in otherArgs.recodes:
+    for (geom, comment, oldValues, newValues), lut, envelope in zip(
+            otherArgs.recodes, otherArgs.luts, otherArgs.envelopes):
+        # don't bother rasterizing polygons that miss this block
+        minX, maxX, minY, maxY = envelope
+        if minX > right or maxX < left or minY > top or maxY < bottom:
+            continue
+
         mask = vectorrasterizer.rasterizeGeometry(geom, extent, 
                     xsize, ysize, 1, True)
 
@@ -75,14 +90,10 @@ def riosRecode(info, inputs, outputs, otherArgs):
         mask = (mask == 1)
 
         # apply the codes
-        # always sort on the old value??
-        for old in sorted(recodedValues.keys()):
-            new = recodedValues[old]
-            subMask = mask & (data == old)
-            data[subMask] = new
+        recodeData(data, mask, oldValues, newValues, lut)
 
-    # make 2d
-    outputs.output = numpy.expand_dims(data, 0)
+    # make 3d (a view, so no copy)
+    outputs.output = data[numpy.newaxis]
 
 
 def doRecodes(input, output, recodes=None, noRAT=False):
@@ -104,22 +115,29 @@ def doRecodes(input, output, recodes=None, noRAT=False):
     recodeFile = open(recodes)
     s = recodeFile.readline()
     recodeFile.close()
-    wktrecodes = json.loads(s)
-
-    # convert the wkts to ogr.Geometry so this doesn't have to happen each block
+    # 'old' key in the dictionary comes back as a string
+    # due to the JSON spec. The recodes are the only objects
+    # in the file so go straight to sorted (old, new) pairs
+    # as they are read.
+    wktrecodes = json.loads(s, object_pairs_hook=lambda pairs:
+            sorted((int(key), new) for key, new in pairs))
+
+    # convert the wkts to ogr.Geometry and the recodes to arrays
+    # so this doesn't have to happen each block
     geomrecodes = []
     for wkt, comment, recodedValues in wktrecodes:
         geom = ogr.CreateGeometryFromWkt(wkt)
-        # 'old' key in the dictionary comes back as a string
-        # due to the JSON spec. Create a new dictionary
-        recodesAsInts = {}
-        for key in recodedValues:
-            recodesAsInts[int(key)] = recodedValues[key]
-
-        geomrecodes.append((geom, comment, recodesAsInts))
+        oldValues = numpy.array([old for old, new in recodedValues],
+                        dtype=numpy.int64)
+        newValues = numpy.array([new for old, new in recodedValues])
+        geomrecodes.append((geom, comment, oldValues, newValues))
 
     otherArgs = applier.OtherInputs()
     otherArgs.recodes = geomrecodes
+    # (minX, maxX, minY, maxY) of each geometry
+    otherArgs.envelopes = [recode[0].GetEnvelope() for recode in geomrecodes]
+    # tables for recodeData(). Created with the first block
+    otherArgs.luts = None
 
     controls = applier.ApplierControls()
     controls.progress = cuiprogress.GDALProgressBar()
@@ -0,0 +1,105 @@
+"""
+Recoding of the data for newfile_from_recode.py. Kept separate
+so it can be used without GDAL or RIOS.
+"""
+
+# This file is part of 'TuiView' - a simple Raster viewer
+# Copyright (C) 2012  Sam Gillingham
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import numpy
+
+# numba is optional, it just makes applying the recodes faster
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True, nogil=True)
+    def recodeLUTMasked(data, mask, lut, minVal):
+        """
+        Replace data with lut[data - minVal] where mask is True
+        in a single pass, spread over the available cores.
+        """
+        for y in prange(data.shape[0]):
+            for x in range(data.shape[1]):
+                if mask[y, x]:
+                    data[y, x] = lut[data[y, x] - minVal]
+
+    @njit(parallel=True, cache=True, nogil=True)
+    def recodeSortedMasked(data, mask, oldValues, newValues):
+        """
+        Replace values in data found in oldValues (sorted) with the
+        matching value in newValues where mask is True.
+        """
+        for y in prange(data.shape[0]):
+            for x in range(data.shape[1]):
+                if mask[y, x]:
+                    value = data[y, x]
+                    idx = numpy.searchsorted(oldValues, value)
+                    if idx < oldValues.size and oldValues[idx] == value:
+                        data[y, x] = newValues[idx]
+
+
+def createRecodeLUT(dtype, oldValues, newValues):
+    """
+    For 8 and 16 bit integer data, return a table of every possible
+    value in dtype with oldValues replaced by newValues. Index it with
+    the data minus the smallest value for dtype. Returns None for
+    other types as the table would be too big.
+    """
+    if dtype.kind not in 'ui' or dtype.itemsize > 2:
+        return None
+
+    info = numpy.iinfo(dtype)
+    lut = numpy.arange(info.min, info.max + 1, dtype=dtype)
+    lut[oldValues - info.min] = newValues
+    return lut
+
+
+def recodeData(data, mask, oldValues, newValues, lut=None):
+    """
+    Recode data in place where mask is True. oldValues must be sorted
+    and newValues is the value each of them is recoded to. lut is
+    the result of createRecodeLUT() for these values, if there is one.
+    All the recodes are applied at once (like the recode plugin does)
+    in a single pass over data rather than a pass for each value.
+    """
+    if len(oldValues) == 0:
+        return
+
+    if HAVE_NUMBA:
+        # just one pass over data, rather than the several
+        # needed to pick out the masked values and put them back
+        if lut is not None:
+            recodeLUTMasked(data, mask, lut, numpy.iinfo(data.dtype).min)
+        else:
+            recodeSortedMasked(data, mask, oldValues, newValues)
+    elif lut is not None:
+        minVal = numpy.iinfo(data.dtype).min
+        data[mask] = lut[data[mask].astype(numpy.int32) - minVal]
+    else:
+        # find where each value would be in oldValues
+        # and recode the ones that are actually there
+        subData = data[mask]
+        idx = numpy.searchsorted(oldValues, subData)
+        idx[idx == len(oldValues)] = 0
+        found = oldValues[idx] == subData
+        subData[found] = newValues[idx[found]]
+        data[mask] = subData
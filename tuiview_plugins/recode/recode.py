@@ -25,26 +25,50 @@ https://github.com/ubarsc/tuiview/wiki/Plugins
 
 import os
 import json
+import collections
 import numpy
 from osgeo import ogr
 from osgeo import gdal_array
 from tuiview import pluginmanager
 from tuiview import viewerlayers
 from tuiview import vectorrasterizer
-from tuiview import viewerLUT
 from tuiview.viewerwidget import VIEWER_TOOL_POLYGON, VIEWER_TOOL_NONE
 from tuiview.viewerwidget import VIEWER_TOOL_QUERY
 
-from PySide6.QtGui import QImage, QPainter, QAction
-from PySide6.QtCore import QObject, QAbstractTableModel, Qt, QPoint
+from PySide6.QtGui import QAction, QColor
+from PySide6.QtCore import QObject, QAbstractTableModel, Qt
 from PySide6.QtWidgets import QApplication, QMessageBox, QHBoxLayout
 from PySide6.QtWidgets import QVBoxLayout, QPushButton, QTableView, QDialog
 from PySide6.QtWidgets import QLineEdit
 
+try:
+    # installed as part of the tuiview_plugins package
+    from tuiview_plugins.recode.recodelut import HAVE_NUMBA, MAX_LUT_SIZE
+    from tuiview_plugins.recode.recodelut import createRecodeLUT
+    from tuiview_plugins.recode.recodelut import applyRecodes
+except ImportError:
+    # loaded by TuiView straight from this directory
+    from recodelut import HAVE_NUMBA, MAX_LUT_SIZE
+    from recodelut import createRecodeLUT, applyRecodes
+
+# shapely (2.0 or later) is optional, it lets us test all
+# the polygons at once when searching for the one under a point
+try:
+    from shapely import contains_xy, from_wkb, box, prepare, STRtree
+    HAVE_SHAPELY = True
+except ImportError:
+    HAVE_SHAPELY = False
+
 DEFAULT_OUTLINE_COLOR = (255, 255, 0, 255)
 "Colour that the outlines are shown in, if displayed"
+OUTLINE_RGBA = QColor(*DEFAULT_OUTLINE_COLOR).rgba()
+"The outline colour as stored in the pixels of a 32 bit QImage"
 RECODE_EXT = ".recode"
 "Extension after the image file extension that the recodes are saved to"
+MASK_CACHE_SIZE = 32
+"Number of rasterized masks (filled or outline) remembered for all polygons"
+FETCH_ROWS = 1024
+"Number of rows the recode table gives the view at a time as it scrolls"
 
 
 def name():
@@ -71,7 +95,7 @@ def action(actioncode, viewer):
         app = QApplication.instance()
         app.savePluginHandler(handler)
 
-        
+
 class Recode(QObject):
     """
     Object that is the plugin. Create actions and menu.
@@ -79,12 +103,18 @@ class Recode(QObject):
     def __init__(self, viewer):
         QObject.__init__(self)
         self.viewer = viewer
-        # a list of tuples
-        # (geom, comment, dictionary_of_recodes)
-        # dictionary_of_recodes keyed on old code
+        # a list of RecodePolygon objects
         self.recodeList = []
+        # shapely versions of the polygons in recodeList and a spatial
+        # index of them. Built when first needed, call
+        # recodeListChanged() to reset
+        self.shapelyGeoms = None
+        self.polyTree = None
+        # numpy array of the envelopes for when we don't have shapely
+        self.envelopes = None
         self.recodeLayer = None
-        self.dataRange = None
+        # the 'old' values offered in the RecodeDialog
+        self.dataValues = None
 
         # Create actions
         self.startAct = QAction(self, triggered=self.startRecode)
@@ -156,16 +186,19 @@ class Recode(QObject):
                 if QMessageBox.question(self.viewer, name(), msg, 
                         QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
                     # Load it
-                    s = open(recodeName).readline()
-                    data = json.loads(s)
+                    with open(recodeName) as fileobj:
+                        s = fileobj.readline()
+                    # 'old' key in the dictionary comes back as a string
+                    # due to the JSON spec. The recodes are the only
+                    # objects in the file so convert the keys as the
+                    # dictionaries are created.
+                    data = json.loads(s, object_pairs_hook=lambda pairs:
+                            {int(key): new for key, new in pairs})
                     for wkt, comment, recodes in data:
                         geom = ogr.CreateGeometryFromWkt(wkt)
-                        # 'old' key in the dictionary comes back as a string
-                        # due to the JSON spec. Create a new dictionary
-                        recodesAsInts = {}
-                        for key in recodes:
-                            recodesAsInts[int(key)] = recodes[key]
-                        self.recodeList.append((geom, comment, recodesAsInts))
+                        self.recodeList.append(RecodePolygon(geom, comment,
+                                recodes))
+                    self.recodeListChanged()
 
             # Create a new layer with the same dataset, but of instance
             # 'RecodeRasterLayer' which knows how to perform recodes on the fly.
@@ -176,9 +209,15 @@ class Recode(QObject):
             layerMgr.addLayer(newLayer)
             self.recodeLayer = newLayer
 
-            # determine the range of data
+            # determine the values to offer for recoding. Every possible
+            # value for small types, otherwise there are far too many so
+            # use the ones in the original layer's current view.
             dataInfo = numpy.iinfo(numpyType)
-            self.dataRange = (dataInfo.min, dataInfo.max)
+            if int(dataInfo.max) - int(dataInfo.min) < MAX_LUT_SIZE:
+                self.dataValues = numpy.arange(dataInfo.min, dataInfo.max + 1,
+                        dtype=numpyType)
+            else:
+                self.dataValues = numpy.unique(oldLayer.image.viewerdata)
 
             # refresh display
             self.recodeLayer.getImage()
@@ -209,13 +248,15 @@ class Recode(QObject):
         geom = toolInfo.getOGRGeometry()
 
         # display the dialog with the recodes
-        dlg = RecodeDialog(self.viewer, self.dataRange)
+        dlg = RecodeDialog(self.viewer, self.dataValues)
         if dlg.exec_() == RecodeDialog.Accepted:
             recodedValues = dlg.getRecodedValues()
             comment = dlg.getComment()
             
             if len(recodedValues) > 0:
-                self.recodeList.append((geom, comment, recodedValues))
+                self.recodeList.append(RecodePolygon(geom, comment,
+                        recodedValues))
+                self.recodeListChanged()
 
                 self.recodeLayer.getImage()
                 self.viewer.viewwidget.viewport().update()
@@ -245,37 +286,104 @@ class Recode(QObject):
         self.viewer.viewwidget.setActiveTool(VIEWER_TOOL_NONE, id(self))
 
         # find it the polygon that constains this point
-        # first create a point
-        ptGeom = ogr.Geometry(ogr.wkbPoint)
-        ptGeom.AddPoint(queryInfo.easting, queryInfo.northing)
-        foundIdx = None
-        for idx, (geom, comment, _) in enumerate(self.recodeList):
-            if geom.Contains(ptGeom):
-                # found one. Should we always stop here?
-                foundIdx = idx
-                break
-
+        foundIdx = self.findPolygon(queryInfo.easting, queryInfo.northing)
         if foundIdx is None:
             QMessageBox.critical(self.viewer, name(), 
                         "No polygon found at point")
             return
 
-        geom, comment, oldrecodes = self.recodeList[foundIdx]
+        recodePoly = self.recodeList[foundIdx]
 
         # show the dialog
-        dlg = RecodeDialog(self.viewer, self.dataRange, comment, oldrecodes)
+        dlg = RecodeDialog(self.viewer, self.dataValues, recodePoly.comment,
+                    recodePoly.recodes)
         if dlg.exec_() == RecodeDialog.Accepted:
             recodedValues = dlg.getRecodedValues()
             comment = dlg.getComment()
             
             if len(recodedValues) == 0:
                 del self.recodeList[foundIdx]
+                self.recodeListChanged()
             else:
-                self.recodeList[foundIdx] = (geom, comment, recodedValues)
+                # keep the same object so the cached masks are reused
+                recodePoly.comment = comment
+                recodePoly.setRecodes(recodedValues)
             
             self.recodeLayer.getImage()
             self.viewer.viewwidget.viewport().update()
 
+    def recodeListChanged(self):
+        """
+        Must be called when polygons are added to or removed
+        from recodeList so the spatial indexes get rebuilt.
+        """
+        self.shapelyGeoms = None
+        self.polyTree = None
+        self.envelopes = None
+
+    def getPolyTree(self):
+        """
+        Returns a shapely STRtree of the polygons in recodeList.
+        Only call if HAVE_SHAPELY.
+        """
+        if self.polyTree is None:
+            self.shapelyGeoms = from_wkb([bytes(recodePoly.geom.ExportToWkb())
+                    for recodePoly in self.recodeList])
+            # prepared geometries make the repeated contains_xy()
+            # tests in findPolygon() much cheaper for complex polygons
+            prepare(self.shapelyGeoms)
+            self.polyTree = STRtree(self.shapelyGeoms)
+        return self.polyTree
+
+    def getVisiblePolygons(self, extent):
+        """
+        Returns the polygons in recodeList whose envelopes overlap
+        the given (left, top, right, bottom) extent, in the same
+        order as recodeList.
+        """
+        (left, top, right, bottom) = extent
+        if HAVE_SHAPELY:
+            hits = self.getPolyTree().query(box(left, bottom, right, top))
+            hits.sort()
+        else:
+            if self.envelopes is None:
+                self.envelopes = numpy.array([recodePoly.envelope
+                        for recodePoly in self.recodeList]).reshape(-1, 4)
+            (minX, maxX, minY, maxY) = self.envelopes.T
+            hits = numpy.flatnonzero((minX <= right) & (maxX >= left) &
+                        (minY <= top) & (maxY >= bottom))
+        return [self.recodeList[idx] for idx in hits]
+
+    def findPolygon(self, easting, northing):
+        """
+        Returns the index into recodeList of the first polygon
+        that contains the given point, or None.
+        """
+        if HAVE_SHAPELY:
+            # use the index to find the candidates then test
+            # all of those in one call
+            tree = self.getPolyTree()
+            candidates = tree.query(box(easting, northing, easting, northing))
+            candidates.sort()
+            hits = candidates[contains_xy(self.shapelyGeoms[candidates],
+                        easting, northing)]
+            if len(hits) > 0:
+                return int(hits[0])
+            return None
+
+        ptGeom = ogr.Geometry(ogr.wkbPoint)
+        ptGeom.AddPoint(easting, northing)
+        for idx, recodePoly in enumerate(self.recodeList):
+            (minX, maxX, minY, maxY) = recodePoly.envelope
+            if (easting < minX or easting > maxX or northing < minY or
+                    northing > maxY):
+                # can't be in this one. Skip the more expensive test.
+                continue
+            if recodePoly.geom.Contains(ptGeom):
+                # found one. Should we always stop here?
+                return idx
+        return None
+
     def saveRecodes(self):
         """
         Save the recodes to a json file. Called in response to
@@ -283,21 +391,95 @@ class Recode(QObject):
         """
         # turn ogr.Geometry's into WKT so they can be saved
         data = []
-        for geom, comment, recodes in self.recodeList:
-            wkt = geom.ExportToWkt()
-            data.append((wkt, comment, recodes))
+        for recodePoly in self.recodeList:
+            wkt = recodePoly.geom.ExportToWkt()
+            data.append((wkt, recodePoly.comment, recodePoly.recodes))
 
-        s = json.dumps(data)
+        # no spaces after the separators - the file is only for us
+        # and the WKT can make it large. Must stay on one line.
+        s = json.dumps(data, separators=(',', ':'))
 
         # find filename to save to
         fname = self.recodeLayer.filename + RECODE_EXT
-        fileobj = open(fname, 'w')
-        # write the info
-        fileobj.write(s + '\n')
-        fileobj.close()
+        with open(fname, 'w') as fileobj:
+            # write the info. Separately rather than adding the
+            # newline on and copying the whole string.
+            fileobj.write(s)
+            fileobj.write('\n')
         self.viewer.showStatusMessage("Recodes saved to %s" % fname)
 
 
+class RecodePolygon(object):
+    """
+    An entry in Recode.recodeList. Holds the polygon, the user's
+    comment and the dictionary of recodes (keyed on old code).
+    Also remembers the rasterized polygons for the last few views so
+    redraws that return to one of them don't have to redo it.
+    """
+    # shared by all the polygons so the memory used is limited
+    # however many there are. Keyed on (polygon, extent, xsize,
+    # ysize, filled), most recent last.
+    masks = collections.OrderedDict()
+
+    def __init__(self, geom, comment, recodes):
+        self.geom = geom
+        # (minX, maxX, minY, maxY)
+        self.envelope = geom.GetEnvelope()
+        self.comment = comment
+        self.setRecodes(recodes)
+
+    def setRecodes(self, recodes):
+        """
+        Set the dictionary of recodes. The lookup table is
+        rebuilt the next time it is needed.
+        """
+        self.recodes = recodes
+        # (dtype, createRecodeLUT() result)
+        self.lutCache = None
+        # True if applying the recodes again to their own output
+        # changes nothing (no 'new' value is recoded to something else).
+        # Only then can overlapping polygons with the same recodes be
+        # applied in one go and still give the same result as one
+        # after the other (which is what newfile_from_recode.py does).
+        self.canMerge = all(recodes.get(new, new) == new
+                for new in recodes.values())
+
+    def getLUT(self, dtype):
+        """
+        Return createRecodeLUT() for our recodes and the given
+        dtype, building it only if the recodes have changed.
+        """
+        if self.lutCache is None or self.lutCache[0] != dtype:
+            self.lutCache = (dtype, createRecodeLUT(self.recodes, dtype))
+        return self.lutCache[1]
+
+    def getMask(self, extent, xsize, ysize, filled):
+        """
+        Return the polygon rasterized for the given view. Filled
+        masks are returned as bool, outlines as 0s and 1s.
+        The returned array is shared so must not be modified.
+        """
+        masks = RecodePolygon.masks
+        key = (self, tuple(extent), xsize, ysize, filled)
+        mask = masks.get(key)
+        if mask is not None:
+            masks.move_to_end(key)
+            return mask
+
+        mask = vectorrasterizer.rasterizeGeometry(self.geom, extent,
+                    xsize, ysize, 1, filled)
+        if filled:
+            # we burnt in 1s, so the 0s and 1s can be viewed
+            # as bool without another pass over the data
+            mask = mask.view(numpy.bool_)
+
+        masks[key] = mask
+        if len(masks) > MASK_CACHE_SIZE:
+            # forget the least recently used
+            masks.popitem(last=False)
+        return mask
+
+
 class RecodeRasterLayer(viewerlayers.ViewerRasterLayer):
     """
     Our Layer class derived from a normal raster layer. 
@@ -307,13 +489,20 @@ class RecodeRasterLayer(viewerlayers.ViewerRasterLayer):
         viewerlayers.ViewerRasterLayer.__init__(self, layermanager)
         self.recode = recode
         self.drawOutlines = False
+        # scratch space for combining masks etc. See getScratchBuffer()
+        self.scratchBuffers = {}
 
-        # LUT for drawing outlines if required
-        self.outlinelut = numpy.zeros((2, 4), numpy.uint8)
-        color = DEFAULT_OUTLINE_COLOR
-        for value, code in zip(color, viewerLUT.RGBA_CODES):
-            lutindex = viewerLUT.CODE_TO_LUTINDEX[code]
-            self.outlinelut[1, lutindex] = value
+    def getScratchBuffer(self, name, shape, dtype):
+        """
+        Return an array of the given shape and type to use as scratch
+        space. There is one for each name and they are only
+        reallocated when the display size (or type) changes.
+        """
+        buffer = self.scratchBuffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = numpy.empty(shape, dtype=dtype)
+            self.scratchBuffers[name] = buffer
+        return buffer
 
     def getImage(self):
         """
@@ -324,49 +513,82 @@ class RecodeRasterLayer(viewerlayers.ViewerRasterLayer):
         viewerlayers.ViewerRasterLayer.getImage(self)
         if self.image.isNull():
             return
-        data = self.image.viewerdata
 
         # get info about where we are.
         extent = self.coordmgr.getWorldExtent()
         (xsize, ysize) = (self.coordmgr.dspWidth, self.coordmgr.dspHeight)
 
-        # apply the recodes
-        for geom, _, recodes in self.recode.recodeList:
-            # create a mask
-            mask = vectorrasterizer.rasterizeGeometry(geom, extent, 
-                    xsize, ysize, 1, True)
-            # convert to 0s and 1s to bool
-            mask = mask == 1
+        # only the polygons that overlap the view need rasterizing
+        recodeList = self.recode.getVisiblePolygons(extent)
+        if len(recodeList) == 0:
+            # nothing to recode or outline, the base class
+            # image is already what we want
+            return
+        data = self.image.viewerdata
+
+        # apply the recodes. Polygons next to each other in the list
+        # with the same recodes have their masks combined so the data
+        # is only gone through once for all of them (if that doesn't
+        # change the result - see RecodePolygon.canMerge).
+        # The outlines are combined in the same pass but can't be
+        # drawn until the end as the colour we want for the outlines
+        # might not be in the LUT.
+        outlineMask = None
+        unionMask = None
+        for idx, recodePoly in enumerate(recodeList):
+            if self.drawOutlines:
+                mask = recodePoly.getMask(extent, xsize, ysize, False)
+                if outlineMask is None:
+                    outlineMask = mask
+                else:
+                    # as for unionMask below. 0s and 1s so just OR them
+                    buffer = self.getScratchBuffer('outline', mask.shape,
+                                mask.dtype)
+                    numpy.bitwise_or(outlineMask, mask, out=buffer)
+                    outlineMask = buffer
+
+            # get the mask
+            mask = recodePoly.getMask(extent, xsize, ysize, True)
+            if unionMask is None:
+                unionMask = mask
+            else:
+                # combine into our scratch buffer rather than
+                # allocating each time (or modifying the cached mask)
+                buffer = self.getScratchBuffer('union', mask.shape,
+                            numpy.bool_)
+                numpy.logical_or(unionMask, mask, out=buffer)
+                unionMask = buffer
+
+            if (idx + 1 < len(recodeList) and recodePoly.canMerge and
+                    recodeList[idx + 1].recodes == recodePoly.recodes):
+                # keep going
+                continue
 
             # apply the codes
-            # always sort on the old value??
-            for old in sorted(recodes.keys()):
-                new = recodes[old]
-                subMask = mask & (data == old)
-                data[subMask] = new
+            lutInfo = recodePoly.getLUT(data.dtype)
+            if lutInfo is not None and not HAVE_NUMBA:
+                scratch = self.getScratchBuffer('recode', data.shape,
+                            data.dtype)
+                maskScratch = self.getScratchBuffer('inrange', data.shape,
+                            numpy.bool_)
+            else:
+                scratch = maskScratch = None
+            applyRecodes(data, unionMask, recodePoly.recodes, lutInfo,
+                    scratch, maskScratch)
+            unionMask = None
 
         # create the image by re-running the lut
         self.image = self.lut.applyLUTSingle(data, self.image.viewermask)
 
-        if self.drawOutlines:
-            # paint the outlines onto the image using QPainter
-            paint = QPainter(self.image)
-
-            drawpt = QPoint(0, 0)  # top left
-
-            # go through the polygons again - can't do this in one
-            # pass as the colour we want for the outlines might not
-            # be in the LUT.
-            for geom, _, recodes in self.recode.recodeList:
-                # this time just get the outlines
-                mask = vectorrasterizer.rasterizeGeometry(geom, extent, 
-                    xsize, ysize, 1, False)
-                # create an image from our mask using our oulinelut
-                bgra = self.outlinelut[mask]
-                outlineimage = QImage(bgra.data, xsize, ysize, QImage.Format_ARGB32)
-                # draw this image onto the original
-                paint.drawImage(drawpt, outlineimage)
-            paint.end()
+        if outlineMask is not None:
+            # the outlines are a single opaque colour so rather than
+            # getting QPainter to blend an image of them over ours
+            # just write the colour straight into the (32 bit) pixels
+            pixels = numpy.frombuffer(self.image.bits(), dtype=numpy.uint32)
+            pixels = pixels.reshape(ysize,
+                        self.image.bytesPerLine() // 4)[:, :xsize]
+            numpy.copyto(pixels, OUTLINE_RGBA,
+                        where=outlineMask.view(numpy.bool_))
 
 
 class RecodeDialog(QDialog):
@@ -374,12 +596,12 @@ class RecodeDialog(QDialog):
     Dialog that allows enter to specify what sort of recoding is to
     happen.
     """
-    def __init__(self, parent, dataRange, comment=None, recodedValues=None):
+    def __init__(self, parent, dataValues, comment=None, recodedValues=None):
         QDialog.__init__(self, parent)
 
         self.setWindowTitle("Recode")
 
-        self.tableModel = RecodeTableModel(self, dataRange, recodedValues)
+        self.tableModel = RecodeTableModel(self, dataValues, recodedValues)
         self.tableView = QTableView(self)
         self.tableView.setModel(self.tableModel)
 
@@ -413,7 +635,7 @@ class RecodeDialog(QDialog):
         returns dictionary of recoded values as user 
         has edited them
         """
-        return self.tableModel.recodedValues
+        return self.tableModel.getRecodedValues()
 
     def getComment(self):
         """
@@ -425,17 +647,72 @@ class RecodeDialog(QDialog):
 class RecodeTableModel(QAbstractTableModel):
     """
     Table model. Basically provides information to be displayed
-    in the table of recodes.
+    in the table of recodes. There is one row for each of the
+    'old' values in dataValues.
     """
-    def __init__(self, parent, dataRange, recodedValues=None):
+    def __init__(self, parent, dataValues, recodedValues=None):
         QAbstractTableModel.__init__(self, parent)
-        self.dataRange = dataRange
+        self.baseDataValues = dataValues
+        self.setRecodedValues(recodedValues)
+
+    def setRecodedValues(self, recodedValues):
+        """
+        Replace all the recoded values. Any views are told
+        once rather than for each row.
+        """
         if recodedValues is None:
             recodedValues = {}
-        self.recodedValues = recodedValues
+
+        self.beginResetModel()
+        # make sure the values already recoded have a row
+        dtype = self.baseDataValues.dtype
+        olds = numpy.array(list(recodedValues.keys()), dtype=dtype)
+        self.dataValues = numpy.union1d(self.baseDataValues, olds)
+        # the 'new' value for each row. Rows that aren't
+        # recoded just have the 'old' value.
+        self.newValues = self.dataValues.copy()
+        rows = numpy.searchsorted(self.dataValues, olds)
+        self.newValues[rows] = numpy.array(list(recodedValues.values()),
+                        dtype=dtype)
+        # rows are given to the view as it scrolls - see fetchMore()
+        self.fetchedRows = min(FETCH_ROWS, len(self.dataValues))
+        self.endResetModel()
+
+    def getRecodedValues(self):
+        """
+        Returns a dictionary of the recoded values keyed
+        on the 'old' value.
+        """
+        rows = numpy.flatnonzero(self.newValues != self.dataValues)
+        return dict(zip(self.dataValues[rows].tolist(),
+                    self.newValues[rows].tolist()))
 
     def rowCount(self, parent):
-        return self.dataRange[1] - self.dataRange[0]
+        "Only the rows fetched so far"
+        return self.fetchedRows
+
+    def canFetchMore(self, parent):
+        """
+        Whether there are rows the view hasn't been given yet
+        """
+        if parent.isValid():
+            return False
+        return self.fetchedRows < len(self.dataValues)
+
+    def fetchMore(self, parent):
+        """
+        Give the view the next lot of rows. Saves it having to
+        deal with a row for every value of a large type at once.
+        """
+        if parent.isValid():
+            return
+        count = min(FETCH_ROWS, len(self.dataValues) - self.fetchedRows)
+        if count <= 0:
+            return
+        self.beginInsertRows(parent, self.fetchedRows,
+                    self.fetchedRows + count - 1)
+        self.fetchedRows += count
+        self.endInsertRows()
 
     def columnCount(self, parent):
         "Just old and new columns"
@@ -467,15 +744,11 @@ class RecodeTableModel(QAbstractTableModel):
         Get the data for a cell.
         """
         if role == Qt.DisplayRole:
-            column = index.column()
-            row = index.row() - self.dataRange[0]
-
-            if column == 1 and row in self.recodedValues:
-                # return 'new' code from our dictionary
-                return self.recodedValues[row]
+            if index.column() == 1:
+                # 'new' code. Same as the 'old' if not recoded
+                return str(self.newValues[index.row()])
             else:
-                # just return the row value which happens to be the 'old'
-                return str(row)
+                return str(self.dataValues[index.row()])
         return None
 
     def setData(self, index, value, role):
@@ -489,24 +762,22 @@ class RecodeTableModel(QAbstractTableModel):
                 return False
 
             try:
-                value = int(value)
-            except TypeError:
+                newValue = int(value)
+            except (TypeError, ValueError):
                 # something that can't be turned into an int. Ignore
                 return False
 
-            row = index.row() - self.dataRange[0]
-            if value == row:
-                # remove it
-                try:
-                    del self.recodedValues[row]
-                except IndexError:
-                    pass
-            else:
-                # add it
-                self.recodedValues[row] = value
+            # check it fits in the data type rather than relying on
+            # numpy which may wrap it round
+            dataInfo = numpy.iinfo(self.newValues.dtype)
+            if newValue < dataInfo.min or newValue > dataInfo.max:
+                return False
+
+            # setting it back to the 'old' value removes the recode
+            self.newValues[index.row()] = newValue
 
-            # update display
-            self.dataChanged.emit(index, index)
+            # update display. Only the text has changed.
+            self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
             return True
 
         return False
@@ -0,0 +1,168 @@
+"""
+Applying recodes to raster data with lookup tables. Kept separate
+from the recode plugin so it doesn't need the GUI.
+"""
+# This file is part of 'TuiView' - a simple Raster viewer
+# Copyright (C) 2012  Sam Gillingham
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import numpy
+
+# numba is optional, it just makes applying the recodes faster
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+MAX_LUT_SIZE = 65536
+"Largest number of values that we build a recode lookup table for"
+
+
+def createRecodeLUT(recodes, dtype):
+    """
+    Create a lookup table for the recodes for data of the given
+    integer dtype. Returns a tuple of (lut, base).
+
+    If base is None the table maps every possible value of dtype
+    and the data can be used to index it directly (signed types
+    rely on numpy's negative indexing). Otherwise the type is too
+    large for this and the table only covers the values from base
+    to the largest recoded value, indexed with data - base.
+
+    Returns None if neither would be a practical size.
+    """
+    dtype = numpy.dtype(dtype)
+    # the table is the same type as the data so applying it doesn't
+    # convert anything. Create the 'new' values as that type straight
+    # away - going via the type numpy picks (float64 for uint64 values
+    # of 2**63 or more) can lose precision.
+    olds = numpy.array(list(recodes.keys()), dtype=dtype)
+    try:
+        news = numpy.array(list(recodes.values()), dtype=dtype)
+    except OverflowError:
+        # doesn't fit (saved before the values were checked when
+        # entered). Wrap round as the values always used to.
+        bits = dtype.itemsize * 8
+        unsignedType = numpy.dtype('u%d' % dtype.itemsize)
+        news = numpy.array([int(new) & (2 ** bits - 1)
+                for new in recodes.values()], dtype=unsignedType).view(dtype)
+
+    if 2 ** (dtype.itemsize * 8) <= MAX_LUT_SIZE:
+        unsignedType = numpy.dtype('u%d' % dtype.itemsize)
+        lut = numpy.arange(2 ** (dtype.itemsize * 8),
+                    dtype=unsignedType).view(dtype)
+        lut[olds] = news
+        return lut, None
+
+    if len(recodes) == 0:
+        return None
+    base = min(recodes)
+    top = max(recodes)
+    if top - base >= MAX_LUT_SIZE:
+        return None
+
+    lut = numpy.arange(base, top + 1, dtype=dtype)
+    lut[olds - base] = news
+    return lut, base
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True, nogil=True)
+    def applyLUTMasked(data, mask, lut):
+        """
+        Replace data with lut[data] where mask is True in a
+        single pass, spread over the available cores.
+        """
+        for y in prange(data.shape[0]):
+            for x in range(data.shape[1]):
+                if mask[y, x]:
+                    data[y, x] = lut[data[y, x]]
+
+    @njit(parallel=True, cache=True, nogil=True)
+    def applyRangedLUTMasked(data, mask, lut, base, top):
+        """
+        As applyLUTMasked() but for a table that only covers
+        base to top (which must be the same type as data).
+        """
+        for y in prange(data.shape[0]):
+            for x in range(data.shape[1]):
+                value = data[y, x]
+                if mask[y, x] and value >= base and value <= top:
+                    data[y, x] = lut[value - base]
+
+
+def applyRecodes(data, mask, recodes, lutInfo, scratch=None,
+        maskScratch=None):
+    """
+    Apply the dictionary of recodes (keyed on old code) to the
+    pixels in data where mask is True. data is updated in place.
+
+    lutInfo should be the result of createRecodeLUT() for these
+    recodes and data.dtype.
+
+    If given, scratch (same shape and type as data) and maskScratch
+    (same shape, bool) are used for working rather than allocating
+    new arrays. They are only needed when numba isn't available.
+    """
+    if lutInfo is None:
+        # too many possible values for a lookup table. Only work
+        # on the pixels inside the polygon and compare against the
+        # original values so recodes don't chain (as they can't
+        # with the lookup table).
+        original = data[mask]
+        recoded = original.copy()
+        for old, new in recodes.items():
+            recoded[original == old] = new
+        data[mask] = recoded
+        return
+
+    lut, base = lutInfo
+    if not HAVE_NUMBA:
+        if scratch is None:
+            scratch = numpy.empty_like(data)
+        if maskScratch is None:
+            maskScratch = numpy.empty(data.shape, dtype=numpy.bool_)
+
+    if base is None:
+        if HAVE_NUMBA:
+            applyLUTMasked(data, mask, lut)
+        else:
+            # all the recodes in a single pass. Looking the whole
+            # array up and copying back where the mask is set is
+            # cheaper than fancy indexing with the mask.
+            lut.take(data, out=scratch)
+            numpy.copyto(data, scratch, where=mask)
+        return
+
+    # make sure comparisons aren't done as floats when
+    # mixing signed and unsigned
+    top = data.dtype.type(base + lut.size - 1)
+    base = data.dtype.type(base)
+    if HAVE_NUMBA:
+        applyRangedLUTMasked(data, mask, lut, base, top)
+    else:
+        # as above, but only values covered by the table change.
+        # Doing the subtraction unsigned means values below base
+        # wrap round and end up above the table too, so one
+        # comparison finds everything in range.
+        unsignedType = numpy.dtype('u%d' % data.itemsize)
+        offset = scratch.view(unsignedType)
+        numpy.subtract(data, base, out=scratch)
+        inRange = numpy.less_equal(offset, lut.size - 1, out=maskScratch)
+        numpy.logical_and(inRange, mask, out=inRange)
+        lut.take(offset, mode='clip', out=scratch)
+        numpy.copyto(data, scratch, where=inRange)
@@ -21,6 +21,7 @@ https://github.com/ubarsc/tuiview/wiki/Plugins
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import math
 from tuiview import pluginmanager
 from tuiview import viewerlayers
 from tuiview.viewerstrings import MESSAGE_TITLE
@@ -73,6 +74,14 @@ class ScaleBarNthArrowQueryPointLayer(viewerlayers.ViewerQueryPointLayer):
         self.scaleBar = scaleBar
         self.citation = citation
         self.logo = logo
+        # the font doesn't change so the size of these characters
+        # doesn't either. Set the first time we draw.
+        self.northRect = None
+        self.zeroRect = None
+        # same pen used for every draw
+        self.pen = QPen()
+        self.pen.setWidth(LINE_WIDTH)
+        self.pen.setColor(LINE_COLOR)
         
     def getImage(self):
         """
@@ -87,18 +96,17 @@ class ScaleBarNthArrowQueryPointLayer(viewerlayers.ViewerQueryPointLayer):
             return
         # now draw our stuff
 
-        pen = QPen()
-        pen.setWidth(LINE_WIDTH)
-        pen.setColor(LINE_COLOR)
-
         paint = QPainter(self.image)
-        paint.setPen(pen)
+        paint.setPen(self.pen)
         paint.setFont(FONT)
         fm = paint.fontMetrics()
+        if self.northRect is None:
+            self.northRect = fm.boundingRect(NORTH_CHARACTER)
+            self.zeroRect = fm.boundingRect('0')
         margin = int(self.coordmgr.dspWidth * MARGIN_FRACTION)
 
         if self.nthArrow:
-            n_rect = fm.boundingRect(NORTH_CHARACTER)
+            n_rect = self.northRect
         
             # nth arrow
             arrowX = self.coordmgr.dspWidth - margin
@@ -125,13 +133,16 @@ class ScaleBarNthArrowQueryPointLayer(viewerlayers.ViewerQueryPointLayer):
                 
                 minSizeWld = minCoord[0] - leftCoord[0]
                 maxSizeWld = maxCoord[0] - leftCoord[0]
-                mult = 10 ** len(str(int(maxSizeWld)))
-                size = None
-                while True:
+                # start with the power of 10 of the leading digit
+                # of maxSizeWld. Usually no need to go further.
+                if maxSizeWld > 0:
+                    mult = 10 ** math.floor(math.log10(maxSizeWld))
                     size = int(maxSizeWld / mult) * mult
-                    if size >= minSizeWld:
-                        break
-                    mult /= 10
+                    while size < minSizeWld:
+                        mult /= 10
+                        size = int(maxSizeWld / mult) * mult
+                else:
+                    size = 0
                     
                 dspXEnd, dspYEnd = self.coordmgr.world2display(leftCoord[0] + size, leftCoord[1])
                 dspXEnd = int(dspXEnd)
@@ -142,7 +153,7 @@ class ScaleBarNthArrowQueryPointLayer(viewerlayers.ViewerQueryPointLayer):
                 paint.drawLine(margin, yDspLoc - halfNotchesSize, margin, yDspLoc + halfNotchesSize)
                 paint.drawLine(dspXEnd, yDspLoc - halfNotchesSize, dspXEnd, yDspLoc + halfNotchesSize)
                 # 0 point
-                zeroRect = fm.boundingRect('0')
+                zeroRect = self.zeroRect
                 paint.drawText(int(margin - (zeroRect.width() / 2)), yDspLoc - halfNotchesSize - 1, '0') 
                 # end text
                 if size > M_TO_KM_THRESHOLD:
@@ -242,7 +253,11 @@ class ScaleBarNthArrow(QObject):
         fname, _ = QFileDialog.getOpenFileName(self.viewer, "Image File", 
                         filter=imageFilter)
         if fname != '':
-            self.scalebarlayer.logo = QImage(fname)
+            # convert once now to the format Qt draws fastest
+            # rather than every time the logo is drawn
+            logo = QImage(fname)
+            self.scalebarlayer.logo = logo.convertToFormat(
+                QImage.Format_ARGB32_Premultiplied)
         else:
             self.scalebarlayer.logo = None
                     
@@ -22,6 +22,8 @@ https://github.com/ubarsc/tuiview/wiki/Plugins
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy
 from tuiview import pluginmanager
 from tuiview import viewerlayers
@@ -39,14 +41,22 @@ from PySide6.QtGui import QPen, QIcon, QAction, QPainter, QPageLayout
 from PySide6.QtGui import QActionGroup
 from PySide6.QtPrintSupport import QPrinter
 
-PLOT_PADDING = 0.05  # of the range of data. Pads this amount above and below min/max
+try:
+    # installed as part of the tuiview_plugins package
+    from tuiview_plugins.timeseries.timeseriesstats import HAVE_NUMBA
+    from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_MIN
+    from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_MAX
+    from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_MEAN
+    from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_MEDIAN
+    from tuiview_plugins.timeseries.timeseriesstats import SUMMARY_STDDEV
+    from tuiview_plugins.timeseries.timeseriesstats import summarizeMasked
+except ImportError:
+    # loaded by TuiView straight from this directory
+    from timeseriesstats import HAVE_NUMBA, SUMMARY_MIN, SUMMARY_MAX
+    from timeseriesstats import SUMMARY_MEAN, SUMMARY_MEDIAN, SUMMARY_STDDEV
+    from timeseriesstats import summarizeMasked
 
-# methods for summarizing a polygon
-SUMMARY_MIN = 0
-SUMMARY_MAX = 1
-SUMMARY_MEAN = 2
-SUMMARY_MEDIAN = 3
-SUMMARY_STDDEV = 4
+PLOT_PADDING = 0.05  # of the range of data. Pads this amount above and below min/max
 
 # key for obtaining date metadata
 DATE_METADATA_KEY = 'LCR_Date'
@@ -84,6 +94,10 @@ class TimeseriesDockWidget(QDockWidget):
     # signals
     profileClosed = Signal(QDockWidget, name='profileClosed')
 
+    # (white, red, green, blue) pens shared by all the plots.
+    # See getPens()
+    pens = None
+
     def __init__(self, parent):
         QDockWidget.__init__(self, "Timeseries", parent)
 
@@ -97,15 +111,6 @@ class TimeseriesDockWidget(QDockWidget):
 
         self.plotWidget = plotwidget.PlotLineWidget(self)
 
-        self.whitePen = QPen(Qt.white)
-        self.whitePen.setWidth(1)
-        self.redPen = QPen(Qt.red)
-        self.redPen.setWidth(1)
-        self.greenPen = QPen(Qt.green)
-        self.greenPen.setWidth(1)
-        self.bluePen = QPen(Qt.blue)
-        self.bluePen.setWidth(1)
-
         self.plotScalingAction = QAction(self, triggered=self.onPlotScaling)
         self.plotScalingAction.setText("Set Plot Scaling")
         self.plotScalingAction.setStatusTip("Set Plot Scaling")
@@ -135,6 +140,21 @@ class TimeseriesDockWidget(QDockWidget):
         # Min, Max. None means 'auto'.
         self.plotScaling = (None, None)
 
+    @classmethod
+    def getPens(cls):
+        """
+        Returns the (white, red, green, blue) pens used for the
+        curves. Created the first time they are needed.
+        """
+        if cls.pens is None:
+            pens = []
+            for color in (Qt.white, Qt.red, Qt.green, Qt.blue):
+                pen = QPen(color)
+                pen.setWidth(1)
+                pens.append(pen)
+            cls.pens = tuple(pens)
+        return cls.pens
+
     def savePlot(self):
         """
         Save the plot as a file. Either .pdf or .ps QPrinter
@@ -171,9 +191,10 @@ class TimeseriesDockWidget(QDockWidget):
         # get rid of curves from last time
         self.plotWidget.removeCurves()
 
+        whitePen, redPen, greenPen, bluePen = self.getPens()
         if len(data.shape) == 2:
             # multi band image
-            penList = [self.redPen, self.greenPen, self.bluePen]
+            penList = [redPen, greenPen, bluePen]
             for band in range(3):
                 bandData = data[..., band]
 
@@ -181,7 +202,7 @@ class TimeseriesDockWidget(QDockWidget):
                 self.plotWidget.addCurve(curve)
         else:
             # single band
-            curve = plotwidget.PlotCurve(steps, data, self.whitePen)
+            curve = plotwidget.PlotCurve(steps, data, whitePen)
             self.plotWidget.addCurve(curve)
 
         # get the users scaling
@@ -226,6 +247,21 @@ class TimeseriesPlot(QObject):
         self.pointActive = False
         self.polyActive = False
         self.lastGeom = None  # last polygon
+        # the raster layers, see getRasterLayers()
+        self.rasterLayers = None
+        # lastGeom rasterized for each of the views it has been
+        # summarized for, keyed on (extent, xsize, ysize).
+        # See getPolygonMask().
+        self.polyMasks = {}
+        # the summaries worked out for each layer for lastGeom.
+        # Keyed on id(layer), values are (viewerdata, stats) where
+        # stats is a dictionary keyed on summary method or None if
+        # the polygon has no valid data. See summarizeLayer()
+        self.layerStats = {}
+        # scratch space for combining masks. See getMaskBuffer()
+        self.threadData = threading.local()
+        # for summarizing layers in parallel. Created when needed
+        self.executor = None
         self.summaryMethod = SUMMARY_MEAN  # set setChecked on self.meanAct below
 
         # Create actions
@@ -280,6 +316,29 @@ class TimeseriesPlot(QObject):
         # etc get fired.
         viewer.viewwidget.polygonCollected.connect(self.newPolySelected)
         viewer.viewwidget.locationSelected.connect(self.newLocationSelected)
+        # so we know when to update self.rasterLayers
+        viewer.viewwidget.layers.layersChanged.connect(self.layersChanged)
+
+    def layersChanged(self):
+        """
+        Called when layers are added, removed or moved. The
+        list of raster layers needs to be worked out again
+        and the summaries for layers that have gone dropped.
+        """
+        self.rasterLayers = None
+        self.layerStats = {}
+
+    def getRasterLayers(self):
+        """
+        Returns a list of the raster layers in the viewer,
+        in the same order as the layer manager. Only worked out
+        again when the layers change.
+        """
+        if self.rasterLayers is None:
+            self.rasterLayers = [layer for layer in
+                    self.viewer.viewwidget.layers.layers
+                    if isinstance(layer, viewerlayers.ViewerRasterLayer)]
+        return self.rasterLayers
 
     def pointTimeseries(self):
         """
@@ -327,56 +386,50 @@ class TimeseriesPlot(QObject):
         # need to go through each layer
         data = []
         steps = []
-        layerMgr = self.viewer.viewwidget.layers
         count = 0
         usingJulianDay = None
-        for layer in layerMgr.layers:
-            if isinstance(layer, viewerlayers.ViewerRasterLayer):
-                # it is a raster layer, get out data at queryInfo.easting, queryInfo.northing
-                imgData = layer.image.viewerdata
-                imgMask = layer.image.viewermask
-
-                col, row = layer.coordmgr.world2display(queryInfo.easting, 
-                                    queryInfo.northing)
-
-                mask = imgMask[row, col]
-                if mask == viewerLUT.MASK_IMAGE_VALUE:
-                    if isinstance(imgData, numpy.ndarray):
-                        # single band image
-
-                        # are we inside this image?
-                        if (col < 0 or row < 0 or row >= imgData.shape[0] or 
-                                col >= imgData.shape[1]):
-                            continue
-
-                        val = imgData[row, col]
-                    else:
-                        # 3 band image
-                        val = []
-                        for band in imgData:
-                            # are we inside this image?
-                            if (col < 0 or row < 0 or row >= band.shape[0] or 
-                                    col >= band.shape[1]):
-                                continue
-
-                            val.append(band[row, col])
-
-                    # check there isn't a mix of single band and multi band
-                    if len(data) > 0 and isinstance(val, list) != isinstance(data[0], list):
-                        QMessageBox.critical(self.viewer, name(), 
-                            "Images cannot be a mix of single and multi bands")
-                        return
-
-                    data.append(val)
-                    julDay = self.addStepForDataset(layer.gdalDataset, count, steps)
-                    if usingJulianDay is not None and julDay != usingJulianDay:
-                        QMessageBox.critical(self.viewer, name(),
-                            "Images must all have %s, or none of them should have it" % DATE_METADATA_KEY)
-                        return
-
-                    usingJulianDay = julDay
-
-                count += 1
+        multiBand = None
+        for layer in self.getRasterLayers():
+            # it is a raster layer, get out data at queryInfo.easting, queryInfo.northing
+            imgData = layer.image.viewerdata
+            imgMask = layer.image.viewermask
+
+            col, row = layer.coordmgr.world2display(queryInfo.easting, 
+                                queryInfo.northing)
+
+            # are we inside this image? The bands are all the same
+            # shape as the mask so only need to check once
+            if (col < 0 or row < 0 or row >= imgMask.shape[0] or
+                    col >= imgMask.shape[1]):
+                continue
+
+            mask = imgMask[row, col]
+            if mask == viewerLUT.MASK_IMAGE_VALUE:
+                if isinstance(imgData, numpy.ndarray):
+                    # single band image
+                    val = imgData[row, col]
+                else:
+                    # 3 band image
+                    val = [band[row, col] for band in imgData]
+
+                # check there isn't a mix of single band and multi band
+                layerMultiBand = isinstance(val, list)
+                if multiBand is not None and layerMultiBand != multiBand:
+                    QMessageBox.critical(self.viewer, name(), 
+                        "Images cannot be a mix of single and multi bands")
+                    return
+                multiBand = layerMultiBand
+
+                data.append(val)
+                julDay = self.addStepForDataset(layer.gdalDataset, count, steps)
+                if usingJulianDay is not None and julDay != usingJulianDay:
+                    QMessageBox.critical(self.viewer, name(),
+                        "Images must all have %s, or none of them should have it" % DATE_METADATA_KEY)
+                    return
+
+                usingJulianDay = julDay
+
+            count += 1
 
         if self.plotWindow is None:
             self.openPlotWindow()
@@ -386,7 +439,6 @@ class TimeseriesPlot(QObject):
         if usingJulianDay:
             steps -= steps.min()
 
-        print(data, steps)
         self.plotWindow.plotData(data, steps)
 
     def openPlotWindow(self):
@@ -421,6 +473,8 @@ class TimeseriesPlot(QObject):
 
         # get the polygon as an ogr.Geometry
         self.lastGeom = toolInfo.getOGRGeometry()
+        self.polyMasks = {}
+        self.layerStats = {}
 
         self.doPolygonSummary()
 
@@ -433,60 +487,81 @@ class TimeseriesPlot(QObject):
         if self.lastGeom is None:
             return
 
+        # first work out which part of each layer we need.
+        # (layer, imgData, imgMask, polyMask) for each layer
+        # the polygon is in.
+        jobs = []
+        # the views the polygon was rasterized for this time. Layers
+        # usually share one so getPolygonMask() only rasterizes once.
+        usedViews = set()
+        for layer in self.getRasterLayers():
+            # it is a raster layer, get out data inside geom
+            imgData = layer.image.viewerdata
+            imgMask = layer.image.viewermask
+
+            # get info about where we are.
+            extent = layer.coordmgr.getWorldExtent()
+            (xsize, ysize) = (layer.coordmgr.dspWidth, layer.coordmgr.dspHeight)
+
+            polyInfo = self.getPolygonMask(extent, xsize, ysize)
+            usedViews.add((tuple(extent), xsize, ysize))
+            if polyInfo is None:
+                # polygon not in this view
+                continue
+
+            # only look at the part of the view the polygon covers
+            window, polyMask = polyInfo
+            imgMask = imgMask[window]
+            if isinstance(imgData, numpy.ndarray):
+                imgData = imgData[window]
+            else:
+                imgData = [band[window] for band in imgData]
+            jobs.append((layer, imgData, imgMask, polyMask))
+
+        # now summarize them. The numpy reductions release the GIL so
+        # without numba do the layers in parallel. The numba kernels
+        # already use all the cores (and shouldn't be run from more
+        # than one thread at once).
+        if HAVE_NUMBA or len(jobs) < 2:
+            results = map(self.summarizeLayer, jobs)
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor()
+            results = self.executor.map(self.summarizeLayer, jobs)
+
         data = []
         steps = []
-        layerMgr = self.viewer.viewwidget.layers
         count = 0
         usingJulianDay = None
-        for layer in layerMgr.layers:
-            if isinstance(layer, viewerlayers.ViewerRasterLayer):
-                # it is a raster layer, get out data inside geom
-                imgData = layer.image.viewerdata
-                imgMask = layer.image.viewermask
-
-                # get info about where we are.
-                extent = layer.coordmgr.getWorldExtent()
-                (xsize, ysize) = (layer.coordmgr.dspWidth, layer.coordmgr.dspHeight)
-
-                # create a mask
-                mask = vectorrasterizer.rasterizeGeometry(self.lastGeom, extent, 
-                        xsize, ysize, 1, True)
-                # convert to 0s and 1s to bool and add in valid data mask
-                mask = (mask == 1) & (imgMask == viewerLUT.MASK_IMAGE_VALUE)
-
-                if not mask.any():
-                    # nothing here
-                    continue
-        
-                # get the data
-                if isinstance(imgData, numpy.ndarray):
-                    # single band image
-
-                    polyData = imgData[mask]
-                    val = self.summarizeData(polyData)
-                else:
-                    # 3 band image
-                    val = []
-                    for band in imgData:
-                        polyData = band[mask]
-                        val.append(self.summarizeData(polyData))
-
-                # check there isn't a mix of single band and multi band
-                if len(data) > 0 and isinstance(val, list) != isinstance(data[0], list):
-                    QMessageBox.critical(self.viewer, name(), 
-                        "Images cannot be a mix of single and multi bands")
-                    return
-
-                data.append(val)
-                julDay = self.addStepForDataset(layer.gdalDataset, count, steps)
-                if usingJulianDay is not None and julDay != usingJulianDay:
-                    QMessageBox.critical(self.viewer, name(),
-                        "Images must all have %s, or none of them should have it" % DATE_METADATA_KEY)
-                    return
-                usingJulianDay = julDay
+        multiBand = None
+        for (layer, imgData, imgMask, polyMask), val in zip(jobs, results):
+            if val is None:
+                # nothing here
+                continue
+
+            # check there isn't a mix of single band and multi band
+            layerMultiBand = isinstance(val, list)
+            if multiBand is not None and layerMultiBand != multiBand:
+                QMessageBox.critical(self.viewer, name(), 
+                    "Images cannot be a mix of single and multi bands")
+                return
+            multiBand = layerMultiBand
+
+            data.append(val)
+            julDay = self.addStepForDataset(layer.gdalDataset, count, steps)
+            if usingJulianDay is not None and julDay != usingJulianDay:
+                QMessageBox.critical(self.viewer, name(),
+                    "Images must all have %s, or none of them should have it" % DATE_METADATA_KEY)
+                return
+            usingJulianDay = julDay
 
             count += 1
 
+        # forget masks for views that aren't shown any more so they
+        # don't build up as the user pans and zooms
+        self.polyMasks = {key: mask for key, mask in self.polyMasks.items()
+                if key in usedViews}
+
         if self.plotWindow is None:
             self.openPlotWindow()
 
@@ -495,25 +570,116 @@ class TimeseriesPlot(QObject):
         if usingJulianDay:
             steps -= steps.min()
 
-        print(data, steps)
         self.plotWindow.plotData(data, steps)
 
-    def summarizeData(self, data):
+    def getPolygonMask(self, extent, xsize, ysize):
         """
-        Summarizes the given array using self.summaryMethod
+        Returns self.lastGeom rasterized for the given view. Only
+        the part of the view covered by the polygon's envelope is
+        rasterized so a tuple of (window, mask) is returned where
+        window is a tuple of (row, col) slices into the view and mask
+        is a bool array the size of the window. Returns None if the
+        polygon is outside the view.
+
+        Layers usually share the same view, and changing the
+        summary method doesn't change it, so the masks are cached.
+        The returned array is shared so must not be modified.
         """
-        if self.summaryMethod == SUMMARY_MIN:
-            return data.min()
-        elif self.summaryMethod == SUMMARY_MAX:
-            return data.max()
-        elif self.summaryMethod == SUMMARY_MEAN:
-            return data.mean()
-        elif self.summaryMethod == SUMMARY_MEDIAN:
-            return numpy.median(data)
-        elif self.summaryMethod == SUMMARY_STDDEV:
-            return data.std()
+        key = (tuple(extent), xsize, ysize)
+        if key in self.polyMasks:
+            return self.polyMasks[key]
+
+        # work out the pixels the envelope covers
+        (left, top, right, bottom) = extent
+        xres = (right - left) / xsize
+        yres = (top - bottom) / ysize
+        (minX, maxX, minY, maxY) = self.lastGeom.GetEnvelope()
+        col1 = max(int(numpy.floor((minX - left) / xres)), 0)
+        col2 = min(int(numpy.ceil((maxX - left) / xres)), xsize)
+        row1 = max(int(numpy.floor((top - maxY) / yres)), 0)
+        row2 = min(int(numpy.ceil((top - minY) / yres)), ysize)
+
+        if col1 >= col2 or row1 >= row2:
+            result = None
         else:
-            raise ValueError('Unknown summary method')
+            # rasterize on the same grid, just for the window
+            windowExtent = (left + col1 * xres, top - row1 * yres,
+                        left + col2 * xres, top - row2 * yres)
+            mask = vectorrasterizer.rasterizeGeometry(self.lastGeom,
+                        windowExtent, col2 - col1, row2 - row1, 1, True)
+            # we burnt in 1s, so the 0s and 1s can be viewed
+            # as bool without another pass over the data
+            mask = mask.view(numpy.bool_)
+            result = ((slice(row1, row2), slice(col1, col2)), mask)
+
+        self.polyMasks[key] = result
+        return result
+
+    def summarizeLayer(self, job):
+        """
+        Summarizes one of the jobs set up in doPolygonSummary().
+        Returns the value for a single band image or a list for
+        multi band, or None if there is no valid data inside the
+        polygon. May be called from a worker thread.
+        """
+        layer, imgData, imgMask, polyMask = job
+        method = self.summaryMethod
+
+        # have we already done this for the layer's current data?
+        viewerdata = layer.image.viewerdata
+        cached = self.layerStats.get(id(layer))
+        if cached is not None and cached[0] is viewerdata:
+            stats = cached[1]
+            if stats is None:
+                return None
+            elif method in stats:
+                return stats[method]
+        else:
+            stats = {}
+
+        # add in valid data mask. Done in our scratch buffer so the
+        # cached polygon mask is left alone and nothing new is allocated.
+        mask = self.getMaskBuffer(imgMask.shape)
+        numpy.equal(imgMask, viewerLUT.MASK_IMAGE_VALUE, out=mask)
+        numpy.logical_and(mask, polyMask, out=mask)
+
+        if not mask.any():
+            self.layerStats[id(layer)] = (viewerdata, None)
+            return None
+
+        if isinstance(imgData, numpy.ndarray):
+            # single band image
+            stats.update(self.summarizeData(imgData, mask))
+        else:
+            # 3 band image
+            bandStats = [self.summarizeData(band, mask) for band in imgData]
+            for key in bandStats[0]:
+                stats[key] = [values[key] for values in bandStats]
+
+        self.layerStats[id(layer)] = (viewerdata, stats)
+        return stats[method]
+
+    def getMaskBuffer(self, shape):
+        """
+        Return a bool array of the given shape to use as scratch
+        space. Only reallocated when the size changes. Each thread
+        gets its own.
+        """
+        maskBuffer = getattr(self.threadData, 'maskBuffer', None)
+        if maskBuffer is None or maskBuffer.shape != shape:
+            maskBuffer = numpy.empty(shape, dtype=numpy.bool_)
+            self.threadData.maskBuffer = maskBuffer
+        return maskBuffer
+
+    def summarizeData(self, data, mask):
+        """
+        Summarizes the values in the given array where mask is True.
+        mask must have at least one True. Returns a dictionary keyed
+        on summary method. This always has self.summaryMethod in it
+        but will have the others if they were worked out at the
+        same time.
+        """
+        return summarizeMasked(data, mask, self.summaryMethod)
 
     def profileClosed(self, profileDock):
         """
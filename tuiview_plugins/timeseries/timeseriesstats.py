@@ -0,0 +1,138 @@
+"""
+Statistics of the pixels inside a polygon for the timeseries
+plugin. Kept separate so it doesn't need the GUI.
+"""
+# This file is part of 'TuiView' - a simple Raster viewer
+# Copyright (C) 2012  Sam Gillingham
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import numpy
+
+# numba is optional, it lets us get all the polygon statistics
+# in one pass over the data
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+# methods for summarizing a polygon
+SUMMARY_MIN = 0
+SUMMARY_MAX = 1
+SUMMARY_MEAN = 2
+SUMMARY_MEDIAN = 3
+SUMMARY_STDDEV = 4
+
+
+def getTypeLimits(dtype):
+    """
+    Returns (min, max) of the values that can be held by
+    the given numpy dtype. Infinities for floating point.
+    """
+    if numpy.issubdtype(dtype, numpy.integer):
+        info = numpy.iinfo(dtype)
+        return info.min, info.max
+    return -numpy.inf, numpy.inf
+
+
+if HAVE_NUMBA:
+    @njit(parallel=True, cache=True, nogil=True)
+    def maskedRowStats(data, mask, counts, mins, maxs, means, m2s):
+        """
+        For each row of data, fill in the count, min, max, mean and
+        sum of squared differences from the mean (Welford's method)
+        of the values where mask is True. Rows are spread over the
+        available cores. min and max are undefined for rows with
+        a count of 0.
+        """
+        for y in prange(data.shape[0]):
+            count = 0
+            mean = 0.0
+            m2 = 0.0
+            minVal = data[y, 0]
+            maxVal = data[y, 0]
+            for x in range(data.shape[1]):
+                if mask[y, x]:
+                    value = data[y, x]
+                    if count == 0 or value < minVal:
+                        minVal = value
+                    if count == 0 or value > maxVal:
+                        maxVal = value
+                    count += 1
+                    delta = value - mean
+                    mean += delta / count
+                    m2 += delta * (value - mean)
+            counts[y] = count
+            mins[y] = minVal
+            maxs[y] = maxVal
+            means[y] = mean
+            m2s[y] = m2
+
+
+def maskedStats(data, mask):
+    """
+    Returns (min, max, mean, stddev) of the values in the 2d array
+    data where mask is True in a single pass. Requires numba and
+    mask must have at least one True.
+    """
+    nrows = data.shape[0]
+    counts = numpy.empty(nrows, dtype=numpy.int64)
+    mins = numpy.empty(nrows, dtype=data.dtype)
+    maxs = numpy.empty(nrows, dtype=data.dtype)
+    means = numpy.empty(nrows, dtype=numpy.float64)
+    m2s = numpy.empty(nrows, dtype=numpy.float64)
+    maskedRowStats(data, mask, counts, mins, maxs, means, m2s)
+
+    # now combine the rows that had something in them
+    used = counts > 0
+    counts = counts[used]
+    means = means[used]
+    total = counts.sum()
+    mean = (counts * means).sum() / total
+    m2 = (m2s[used] + counts * (means - mean) ** 2).sum()
+    return mins[used].min(), maxs[used].max(), mean, numpy.sqrt(m2 / total)
+
+
+def summarizeMasked(data, mask, method):
+    """
+    Summarizes the values in the given array where mask is True
+    with one of the SUMMARY_* methods. mask must have at least one
+    True. Returns a dictionary keyed on summary method. This always
+    has method in it but will have the others if they were worked
+    out at the same time.
+    The reductions work on data directly rather than on a copy
+    of the values inside the polygon, except for the median.
+    """
+    if HAVE_NUMBA and method != SUMMARY_MEDIAN:
+        minVal, maxVal, mean, stddev = maskedStats(data, mask)
+        return {SUMMARY_MIN: minVal, SUMMARY_MAX: maxVal,
+                SUMMARY_MEAN: mean, SUMMARY_STDDEV: stddev}
+
+    if method == SUMMARY_MIN:
+        value = data.min(where=mask, initial=getTypeLimits(data.dtype)[1])
+    elif method == SUMMARY_MAX:
+        value = data.max(where=mask, initial=getTypeLimits(data.dtype)[0])
+    elif method == SUMMARY_MEAN:
+        value = data.mean(where=mask)
+    elif method == SUMMARY_MEDIAN:
+        # data[mask] is already a copy so let median
+        # partition it in place rather than copying again
+        value = numpy.median(data[mask], overwrite_input=True)
+    elif method == SUMMARY_STDDEV:
+        value = data.std(where=mask)
+    else:
+        raise ValueError('Unknown summary method')
+    return {method: value}